@@ -3,14 +3,16 @@
 """
 This module is the driver module for PyQuOpt
 """
+import os
 import sys
+import time
 import numpy as np
-from mpi4py import MPI
 sys.path.append('../..')
 
 # User-defined libraries
 from pyquopt import *
-from utils import generate_circuit_structures
+from pyquopt.search import record_class
+from utils import iter_circuit_structures
 
 
 mq_dict = {
@@ -18,55 +20,75 @@ mq_dict = {
     1: ThreeGates.CX02
 }
 
+# Set optimization hyperparameters
+num_qubits = 3
+num_mq_instructions = 8  # want to explore circuits with eight multi-qubit gates
+num_params = 3 * num_qubits * (num_mq_instructions + 1)  # formula explained in MICRO paper
+alpha = 0  # penalty for non-standard angles
+gamma = 0  # penalty for large angles
+non_fixed_params = np.ones(num_params)  # leave all parameters unfixed
+fixed_params_vals = np.zeros(num_params)  # unfixed parameters should have a "fixed" value of 0
+for i in range(9):
+    non_fixed_params[i] = 0
+    non_fixed_params[-i - 1] = 0  # first and last layers should contain no U3 gates
+num_guesses = 20  # optimization starts per structure
+
+# Only one representative per symmetry class is optimized; the others inherit its result
+canonicalizer = StructureCanonicalizer(num_qubits=num_qubits, mq_dict=mq_dict, target=ThreeGates.TOFFOLI,
+                                       non_fixed_params=non_fixed_params, fixed_params_vals=fixed_params_vals)
+# Structures that provably cannot reach the Toffoli gate are never optimized
+prescreen = StructurePrescreen(num_qubits=num_qubits, mq_dict=mq_dict, target=ThreeGates.TOFFOLI)
+
+
+def optimize_structure(structure):
+    """
+    Runs the optimization for one circuit structure.
+
+    :param structure: sequence of multi-qubit instruction indices
+    :return: tuple of the optimized parameters, their cost, their unitary distance to the Toffoli gate
+    and the wall-clock time spent
+    """
+    start_time = time.perf_counter()
+
+    # Create unitary builder to check validity of implementation
+    ub = UnitaryBuilder(num_qubits=num_qubits, mq_instructions=list(structure), mq_dict=mq_dict)
+
+    # Run optimization routing num_guesses times for this structure
+    optimizer = Optimizer(num_qubits=num_qubits, mq_instructions=list(structure), mq_dict=mq_dict,
+                          target=ThreeGates.TOFFOLI,
+                          alpha=alpha, gamma=gamma, non_fixed_params=non_fixed_params,
+                          fixed_params_vals=fixed_params_vals)
+
+    opt_params, opt_val = optimizer.find_parameters_least_squares(num_guesses)
+    implementation_matrix = ub.build_unitary(opt_params)
+    unitary_distance = get_unitary_infidelity(ThreeGates.TOFFOLI, implementation_matrix, 8)
+
+    return opt_params, opt_val, unitary_distance, time.perf_counter() - start_time
+
 
 if __name__ == '__main__':
     """
-    Program entry
+    Program entry: under MPI, rank 0 hands structures to the other ranks on demand and records the
+    results; without mpi4py the structures are spread over all local cores. Structures already in the
+    results store are skipped, so a killed job resumes where it stopped.
     """
+    store = None
+    pending = None
+    if is_coordinator():
+        os.makedirs(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'out'), exist_ok=True)
+        store = ResultsStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'out', 'linear_toffoli.sqlite'))
+        structures = iter_circuit_structures(num_mq_ins=len(mq_dict), num_layers=num_mq_instructions)
+        pending = [structure for structure in store.pending(structures)
+                   if prescreen.is_feasible(structure) and not canonicalizer.is_reducible(structure)
+                   and canonicalizer.is_canonical(structure)]
+
+    def record_result(structure, result):
+        """
+        Records a representative's result and the results its symmetry class inherits.
+        """
+        opt_params, opt_val, unitary_distance, seconds = result
+        record_class(store, canonicalizer, structure, opt_params, opt_val, unitary_distance, num_guesses, seconds)
 
-    comm = MPI.COMM_WORLD
-    rank = comm.Get_rank()
-    size = comm.Get_size()
-
-    # Set optimization hyperparameters
-    num_qubits = 3
-    num_mq_instructions = 8  # want to explore circuits with eight multi-qubit gates
-    num_params = 3 * num_qubits * (num_mq_instructions + 1)  # formula explained in MICRO paper
-    alpha = 0  # penalty for non-standard angles
-    gamma = 0  # penalty for large angles
-    non_fixed_params = np.ones(num_params)  # leave all parameters unfixed
-    fixed_params_vals = np.zeros(num_params)  # unfixed parameters should have a "fixed" value of 0
-    for i in range(9):
-        non_fixed_params[i] = 0
-        non_fixed_params[-i] = 0  # first and last layers should contain no U3 gates
-
-    # Generate circuit substructures and determine which ones this rank will explore
-    circuit_structures = generate_circuit_structures(num_mq_ins=len(mq_dict), num_layers=num_mq_instructions)
-    start = 16 * rank
-    stop = 16 * (rank + 1)
-
-    for i in range(start, stop):
-        structure = circuit_structures[i]
-
-        # Create unitary builder to check validity of implementation
-        ub = UnitaryBuilder(num_qubits=num_qubits, mq_instructions=structure, mq_dict=mq_dict)
-
-        # Run optimization routing 20 times for this structure
-        optimizer = Optimizer(num_qubits=num_qubits, mq_instructions=structure, mq_dict=mq_dict,
-                              target=ThreeGates.TOFFOLI,
-                              alpha=alpha, gamma=gamma, non_fixed_params=non_fixed_params,
-                              fixed_params_vals=fixed_params_vals)
-
-        opt_params, opt_val = optimizer.find_parameters_least_squares(20)
-        implementation_matrix = ub.build_unitary(opt_params)
-        unitary_distance = get_unitary_infidelity(ThreeGates.TOFFOLI, implementation_matrix, 8)
-
-        if unitary_distance < 0.01:
-            data_file = open(f"/home/mbowman/Toffoli-Optimization/applications/context/out/out_linear_{''.join(structure)}.txt", "w")
-            data_file.write("PyQuOpt Results\n==========\n")
-            data_file.write(f"Rank {rank} Computation\n======\n")
-            data_file.write(f"Parameters: {list(opt_params)}")
-            data_file.write("\n")
-            data_file.write(f"Unitary distance: {unitary_distance}")
-            data_file.write("\n")
-            data_file.close()
+    distribute_tasks(optimize_structure, pending, callback=record_result)
+    if store is not None:
+        store.close()
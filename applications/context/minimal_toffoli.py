@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module is a driver module for PyQuOpt that searches for the fewest CX gates implementing the
+Toffoli gate with all-to-all connectivity, trying one depth after the other.
+"""
+import os
+import sys
+sys.path.append('../..')
+
+# User-defined libraries
+from pyquopt import *
+
+
+mq_dict = {
+    0: ThreeGates.CX01,
+    1: ThreeGates.CX02,
+    2: ThreeGates.CX12
+}
+
+# Set optimization hyperparameters
+num_qubits = 3
+max_mq_instructions = 8  # give up if no circuit with at most eight multi-qubit gates is found
+alpha = 0  # penalty for non-standard angles
+gamma = 0  # penalty for large angles
+fixed_layers = (0, -1)  # first and last layers should contain no U3 gates
+num_guesses = 20  # optimization starts per structure
+
+
+if __name__ == '__main__':
+    """
+    Program entry: optimizes depth 1, 2, ... until a depth admits a structure implementing the Toffoli
+    gate, then finishes that depth to collect all minimal structures. Results are kept in a results
+    store, so an interrupted search resumes where it stopped.
+    """
+    os.makedirs(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'out'), exist_ok=True)
+    with ResultsStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'out', 'minimal_toffoli.sqlite')) as store:
+        search = DepthIterativeSearch(num_qubits=num_qubits, mq_dict=mq_dict, target=ThreeGates.TOFFOLI,
+                                      alpha=alpha, gamma=gamma, fixed_layers=fixed_layers, store=store)
+        depth, solutions = search.search(max_mq_instructions, num_guesses=num_guesses, finish_depth=True)
+
+    if depth is None:
+        print(f"No structure with at most {max_mq_instructions} multi-qubit gates implements the Toffoli gate")
+    else:
+        print(f"Minimal number of multi-qubit gates: {depth}")
+        for structure, (opt_params, opt_val) in solutions.items():
+            print(f"Structure {list(structure)}: cost {opt_val}")
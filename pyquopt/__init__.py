@@ -5,6 +5,14 @@ Package for discovering optimal quantum circuit implementations of
 quantum gates and operations.
 """
 from .optimizer import Optimizer
-from .gates import ThreeGates, TwoGates
+from .parallel import MultistartPool, broadcast, distribute_tasks, is_coordinator
+from .gates import ThreeGates, TwoGates, build_mq_dict, controlled_x, make_gate
 from .unitary import UnitaryBuilder
+from .structures import count_circuit_structures, iter_circuit_structures, rank_structure, unrank_structure
+from .symmetry import StructureCanonicalizer
+from .store import ResultsStore
+from .prescreen import StructurePrescreen
+from .search import DepthIterativeSearch, SuccessiveHalving, WarmStartSearch
+from .snapping import snap_params
+from .stats import OptimizerStats
 from .utils import *
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+"""
+Runs the PyQuOpt command line interface (see pyquopt.cli).
+"""
+from .cli import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the performance benchmark suite of PyQuOpt, run as
+
+    python -m pyquopt bench [--quick] [--output results.json] [--baseline baseline.json]
+
+It times the hot paths of a structure search:
+
+* build_unitary/q<n>/l<layers>: UnitaryBuilder.build_unitary for 2 to 5 qubits and 1 to 10 layers
+* residuals, jacobian, bfgs_objective: least_square_residuals, least_square_jacobian and
+  bfgs_objective_function of the 6-layer Toffoli circuit
+* time_to_solution/full_toffoli, time_to_solution/linear_toffoli: seeded multistart runs until the
+  6-layer full-connectivity or 8-layer linear-connectivity Toffoli circuit reaches the target
+* structures/l<layers>: enumeration of the circuit structures over three instructions (as done by
+  generate_circuit_structures in applications/context)
+
+Every benchmark reports the seconds of one call, the best of a few repeats. Results are saved as
+JSON and compared with a baseline saved the same way, e.g. on the same machine before a change.
+"""
+from typing import Callable, Dict, List, Tuple
+import json
+import platform
+import time
+import numpy as np
+import scipy
+from .gates import ThreeGates, build_mq_dict
+from .optimizer import Optimizer
+from .stats import OptimizerStats
+from .structures import iter_circuit_structures
+from .unitary import UnitaryBuilder
+
+FULL_TOFFOLI = ({0: ThreeGates.CX01, 1: ThreeGates.CX02, 2: ThreeGates.CX12}, (2, 1, 2, 1, 0, 0))
+LINEAR_TOFFOLI = ({0: ThreeGates.CX01, 1: ThreeGates.CX02}, (1, 0, 0, 1, 0, 0, 1, 0))
+
+
+def _time_per_call(function: Callable, min_seconds: float = 0.05, repeat: int = 3) -> float:
+    """
+    Times a function: calls it often enough for one round to last min_seconds, then keeps the fastest
+    of repeat rounds.
+
+    :param function: function without arguments
+    :param min_seconds: minimal duration of a round
+    :param repeat: number of rounds
+    :return: seconds per call
+    """
+    number = 1
+    while True:
+        start_time = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= min_seconds:
+            break
+        number *= 2
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter() - start_time)
+
+    return best / number
+
+
+def bench_build_unitary(qubit_counts: List[int], layer_counts: List[int]) -> Dict[str, Dict[str, float]]:
+    """
+    Times build_unitary on CX circuits with linear connectivity.
+
+    :param qubit_counts: numbers of qubits
+    :param layer_counts: numbers of multi-qubit instructions
+    :return: dictionary mapping benchmark names to results
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for num_qubits in qubit_counts:
+        mq_dict = build_mq_dict([(qubit, qubit + 1) for qubit in range(num_qubits - 1)], num_qubits=num_qubits)
+        for num_layers in layer_counts:
+            structure = [layer % len(mq_dict) for layer in range(num_layers)]
+            builder = UnitaryBuilder(num_qubits, structure, mq_dict)
+            params = rng.random(3 * num_qubits * (num_layers + 1)) * 2 * np.pi
+            results[f'build_unitary/q{num_qubits}/l{num_layers}'] = {
+                'seconds': _time_per_call(lambda: builder.build_unitary(params))}
+
+    return results
+
+
+def bench_objectives() -> Dict[str, Dict[str, float]]:
+    """
+    Times the least-squares residuals and Jacobian and the BFGS objective of the 6-layer Toffoli circuit.
+
+    :return: dictionary mapping benchmark names to results
+    """
+    mq_dict, structure = FULL_TOFFOLI
+    num_params = 9 * (len(structure) + 1)
+    optimizer = Optimizer(3, list(structure), mq_dict, ThreeGates.TOFFOLI, 0, 0, np.ones(num_params),
+                          np.zeros(num_params))
+    params = np.random.default_rng(0).random(num_params) * 2 * np.pi
+
+    return {
+        'residuals': {'seconds': _time_per_call(lambda: optimizer.least_square_residuals(params))},
+        'jacobian': {'seconds': _time_per_call(lambda: optimizer.least_square_jacobian(params))},
+        'bfgs_objective': {'seconds': _time_per_call(lambda: optimizer.bfgs_objective_function(params))},
+    }
+
+
+def bench_time_to_solution(name: str, mq_dict: Dict[int, np.ndarray], structure: Tuple[int, ...],
+                           max_starts: int = 50, seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """
+    Times a seeded multistart run on a structure known to implement the Toffoli gate, stopping at
+    the first start that reaches it.
+
+    :param name: benchmark name
+    :param mq_dict: dictionary of multi-qubit instructions
+    :param structure: circuit structure
+    :param max_starts: starts after which the run gives up
+    :param seed: seed of the random starting points
+    :return: dictionary mapping the benchmark name to the result, with the number of starts used
+    """
+    num_params = 9 * (len(structure) + 1)
+    stats = OptimizerStats()
+    optimizer = Optimizer(3, list(structure), mq_dict, ThreeGates.TOFFOLI, 0, 0, np.ones(num_params),
+                          np.zeros(num_params), stats=stats)
+    start_time = time.perf_counter()
+    optimizer.find_parameters_least_squares(max_starts, infidelity_threshold=1e-8, seed=seed)
+    seconds = time.perf_counter() - start_time
+    summary = stats.summary(1e-8)
+
+    return {f'time_to_solution/{name}': {'seconds': seconds, 'starts': summary['starts'],
+                                         'solved': summary['successes'] > 0,
+                                         'residual_evaluations': summary['residual_evaluations']}}
+
+
+def bench_structures(layer_counts: List[int]) -> Dict[str, Dict[str, float]]:
+    """
+    Times the enumeration of all circuit structures over three instructions.
+
+    :param layer_counts: numbers of layers
+    :return: dictionary mapping benchmark names to results, with the number of structures
+    """
+    results = {}
+    for num_layers in layer_counts:
+        count = 3 ** num_layers
+        seconds = _time_per_call(lambda: list(iter_circuit_structures(3, num_layers)), repeat=2)
+        results[f'structures/l{num_layers}'] = {'seconds': seconds, 'structures': count}
+
+    return results
+
+
+def run_benchmarks(quick: bool = False, select: str = None) -> Dict[str, object]:
+    """
+    Runs the benchmark suite.
+
+    :param quick: run smaller grids and skip the linear Toffoli time-to-solution
+    :param select: only run benchmarks whose name starts with this prefix
+    :return: dictionary with the environment and the results of every benchmark
+    """
+    # Each suite with the names of the benchmarks it runs
+    suites = [
+        (['build_unitary'], lambda: bench_build_unitary([2, 3] if quick else [2, 3, 4, 5],
+                                                        [1, 5, 10] if quick else list(range(1, 11)))),
+        (['residuals', 'jacobian', 'bfgs_objective'], bench_objectives),
+        (['time_to_solution/full_toffoli'], lambda: bench_time_to_solution('full_toffoli', *FULL_TOFFOLI)),
+        (['structures'], lambda: bench_structures([6, 8] if quick else [4, 6, 8, 10])),
+    ]
+    if not quick:
+        suites.insert(3, (['time_to_solution/linear_toffoli'],
+                          lambda: bench_time_to_solution('linear_toffoli', *LINEAR_TOFFOLI)))
+
+    results = {}
+    for names, suite in suites:
+        if select is None or any(name.startswith(select) or select.startswith(name) for name in names):
+            results.update(suite())
+    if select is not None:
+        results = {name: result for name, result in results.items() if name.startswith(select)}
+
+    return {
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+                        'machine': platform.machine(), 'created': time.time()},
+        'benchmarks': results,
+    }
+
+
+def save_results(results: Dict[str, object], path: str) -> None:
+    """
+    Writes benchmark results to a JSON file.
+
+    :param results: output of run_benchmarks
+    :param path: file name
+    """
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=1)
+
+
+def load_results(path: str) -> Dict[str, object]:
+    """
+    Reads benchmark results written by save_results.
+
+    :param path: file name
+    :return: dictionary in the format of run_benchmarks
+    """
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def compare_results(results: Dict[str, object], baseline: Dict[str, object], tolerance: float = 0.25,
+                    select: str = None) -> List[Tuple[str, float, float, str]]:
+    """
+    Compares benchmark timings with a baseline.
+
+    :param results: output of run_benchmarks
+    :param baseline: earlier output of run_benchmarks
+    :param tolerance: relative slowdown (or speedup) below which a benchmark counts as unchanged
+    :param select: only compare benchmarks whose name starts with this prefix
+    :return: list of (name, baseline seconds, seconds, verdict) for the benchmarks in either, where the
+    verdict is 'slower', 'faster', 'unchanged', 'new' or 'missing'
+    """
+    new, old = results['benchmarks'], baseline['benchmarks']
+    if select is not None:
+        old = {name: result for name, result in old.items() if name.startswith(select)}
+    comparison = []
+    for name in list(new) + [name for name in old if name not in new]:
+        if name not in old:
+            comparison.append((name, np.nan, new[name]['seconds'], 'new'))
+            continue
+        if name not in new:
+            comparison.append((name, old[name]['seconds'], np.nan, 'missing'))
+            continue
+        ratio = new[name]['seconds'] / old[name]['seconds']
+        verdict = 'slower' if ratio > 1 + tolerance else 'faster' if ratio < 1 / (1 + tolerance) else 'unchanged'
+        comparison.append((name, old[name]['seconds'], new[name]['seconds'], verdict))
+
+    return comparison
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the command line interface of PyQuOpt, run as
+
+    python -m pyquopt search config.json
+
+or, to run the benchmark suite (see bench), as
+
+    python -m pyquopt bench [--quick] [--output results.json] [--baseline baseline.json]
+
+The search configuration is a JSON object; every key except target and gates is optional:
+
+* num_qubits (3): number of qubits of the circuit
+* target: name of the target gate, e.g. "TOFFOLI", or "CONTROLLED_X" for the gate with every qubit but
+  the last as control
+* gates: the multi-qubit instructions, e.g. ["CX01", "CX02", "CX12"], or a core gate and a coupling
+  map, e.g. {"gate": "CX", "coupling_map": [[0, 1], [1, 2]]}
+* min_depth (1), max_depth (min_depth): range of numbers of multi-qubit instructions to sweep
+* stop_at_feasible (true): stop after the first depth at which a structure reaches the target
+* fixed_layers ([]): indices of the U3 layers fixed to the identity, e.g. [0, -1]
+* alpha (0), gamma (0): penalty weights of the least-squares objective
+* restarts (20): least-squares starts per structure
+* precision ("double"): "mixed" screens every start in single precision and refines promising ones in double
+* infidelity_threshold (1e-8): infidelity at which a structure counts as feasible and its starts stop
+* backend ("processes"): "serial" for one core, "processes" for local cores, "mpi" to run under mpirun
+* procs (all cores): number of local processes of the "processes" backend
+* store ("pyquopt_search.sqlite"): results store, relative to the configuration file; reruns resume from it
+* seed (fresh entropy): seed of the random starting points
+
+Gates named on their own come from TwoGates (2 qubits) or ThreeGates (3 qubits) and must act on
+num_qubits qubits. A [name, qubits] pair places a core gate (CX, CZ, CV, CR, ECR, ISWAP, MCR, CCX) or a
+TwoGates or ThreeGates gate on the given qubits of a larger register, e.g. ["CX", [4, 2]], and is
+applied by local contraction; targets may be placed the same way.
+"""
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from .bench import compare_results, load_results, run_benchmarks, save_results
+from .gates import CORE_GATES, ThreeGates, TwoGates, build_mq_dict, controlled_x
+from .parallel import broadcast, is_coordinator
+from .search import DepthIterativeSearch
+from .store import ResultsStore
+from .unitary import instruction_matrix
+
+DEFAULT_CONFIG = {
+    'num_qubits': 3,
+    'min_depth': 1,
+    'max_depth': None,
+    'stop_at_feasible': True,
+    'fixed_layers': [],
+    'alpha': 0,
+    'gamma': 0,
+    'restarts': 20,
+    'precision': 'double',
+    'infidelity_threshold': 1e-8,
+    'backend': 'processes',
+    'procs': None,
+    'store': 'pyquopt_search.sqlite',
+    'seed': None,
+}
+BACKENDS = ('serial', 'processes', 'mpi')
+
+
+def load_config(path: str) -> Dict[str, object]:
+    """
+    Reads and validates a search configuration, filling in defaults.
+
+    :param path: file name of the JSON configuration
+    :return: dictionary of configuration values, with the store path resolved and a fixed seed
+    """
+    with open(path) as config_file:
+        user_config = json.load(config_file)
+
+    unknown = set(user_config) - set(DEFAULT_CONFIG) - {'target', 'gates'}
+    if unknown:
+        raise Exception(f"Error: unknown configuration keys {sorted(unknown)}")
+    if 'target' not in user_config or 'gates' not in user_config:
+        raise Exception("Error: configuration needs a target and gates")
+
+    config = dict(DEFAULT_CONFIG, **user_config)
+    if config['max_depth'] is None:
+        config['max_depth'] = config['min_depth']
+    if not 1 <= config['min_depth'] <= config['max_depth']:
+        raise Exception("Error: invalid depth range")
+    if config['backend'] not in BACKENDS:
+        raise Exception(f"Error: backend must be one of {BACKENDS}")
+    config['store'] = os.path.join(os.path.dirname(os.path.abspath(path)), config['store'])
+    if config['seed'] is None:
+        config['seed'] = int(np.random.SeedSequence().entropy)  # workers must share the seed
+    resolve_gates(config)
+
+    return config
+
+
+def resolve_gates(config: Dict[str, object]) -> Tuple[Dict[int, object], np.ndarray]:
+    """
+    Looks up the gate set and target of a configuration by name.
+
+    :param config: configuration dictionary (see load_config)
+    :return: tuple of the dictionary of multi-qubit instructions (matrices or (gate, qubits) pairs) and
+    the target matrix
+    """
+    gate_classes = {2: TwoGates, 3: ThreeGates}
+    num_qubits = config['num_qubits']
+
+    def lookup(spec):
+        name, qubits = (spec, None) if isinstance(spec, str) else (spec[0], tuple(spec[1]))
+        if qubits is not None and name in CORE_GATES:
+            return CORE_GATES[name], qubits
+        size = num_qubits if qubits is None else len(qubits)
+        if size not in gate_classes or not hasattr(gate_classes[size], name):
+            raise Exception(f"Error: unknown gate {name} for {size} qubits")
+        gate = getattr(gate_classes[size], name)
+        return gate if qubits is None else (gate, qubits)
+
+    if config['target'] == 'CONTROLLED_X':
+        target = controlled_x(num_qubits)
+    else:
+        target = instruction_matrix(lookup(config['target']), num_qubits)
+
+    if isinstance(config['gates'], dict):
+        mq_dict = build_mq_dict(config['gates']['coupling_map'], config['gates'].get('gate', 'CX'), num_qubits, local=True)
+    else:
+        mq_dict = {index: lookup(spec) for index, spec in enumerate(config['gates'])}
+
+    return mq_dict, target
+
+
+def run_search(config: Dict[str, object]) -> Optional[Dict[int, List[Tuple[int, ...]]]]:
+    """
+    Sweeps the configured depths with DepthIterativeSearch.search_depth. At every depth the structures
+    that pass the pre-screen, are not reducible, represent their symmetry class and are not yet in the
+    store are optimized in parallel, warm-started from the solutions of the shallower depths, and
+    every result is recorded in the store as it arrives.
+
+    :param config: configuration dictionary (see load_config)
+    :return: dictionary mapping each swept depth to its feasible structures on the coordinator, None
+    on the other MPI ranks
+    """
+    if config['backend'] == 'mpi':
+        try:
+            import mpi4py
+        except ImportError:
+            raise Exception("Error: the mpi backend needs mpi4py")
+    procs = {'serial': 1, 'processes': config['procs'], 'mpi': None}[config['backend']]
+
+    mq_dict, target = resolve_gates(config)
+    coordinator = is_coordinator()
+    store = None
+    if coordinator:
+        os.makedirs(os.path.dirname(config['store']), exist_ok=True)
+        store = ResultsStore(config['store'])
+    search = DepthIterativeSearch(config['num_qubits'], mq_dict, target, config['alpha'], config['gamma'],
+                                  config['fixed_layers'], store=store, precision=config['precision'])
+    feasible = {}
+
+    try:
+        for num_layers in range(config['min_depth'], config['max_depth'] + 1):
+            search.search_depth(num_layers, config['restarts'], infidelity_threshold=config['infidelity_threshold'],
+                                finish_depth=True, seed=config['seed'], procs=procs)
+
+            stop = False
+            if coordinator:
+                results = store.load(num_layers=num_layers, max_infidelity=config['infidelity_threshold'])
+                feasible[num_layers] = sorted(set(results['structure']))
+                print(f"Depth {num_layers}: {len(feasible[num_layers])} feasible structures")
+                stop = config['stop_at_feasible'] and len(feasible[num_layers]) > 0
+            if broadcast(stop):
+                break
+    finally:
+        if store is not None:
+            store.close()
+
+    return feasible if coordinator else None
+
+
+def main(argv: List[str] = None) -> None:
+    """
+    Entry point of python -m pyquopt.
+
+    :param argv: command line arguments (default: sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(prog='python -m pyquopt',
+                                     description='Discover quantum circuit implementations of quantum gates.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    search_parser = commands.add_parser('search', help='sweep circuit structures as described by a configuration file')
+    search_parser.add_argument('config', help='JSON configuration file')
+    search_parser.add_argument('--procs', type=int, help='number of local processes (overrides the configuration)')
+    bench_parser = commands.add_parser('bench', help='time the hot paths, optionally against a baseline')
+    bench_parser.add_argument('--quick', action='store_true', help='run a reduced suite')
+    bench_parser.add_argument('--select', help='only run benchmarks whose name starts with this prefix')
+    bench_parser.add_argument('--output', help='JSON file to save the results to, e.g. as a new baseline')
+    bench_parser.add_argument('--baseline', help='JSON file of earlier results to compare with')
+    bench_parser.add_argument('--tolerance', type=float, default=0.25,
+                              help='relative change below which a benchmark counts as unchanged (default 0.25)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'search':
+        config = load_config(args.config)
+        if args.procs is not None:
+            config['procs'] = args.procs
+        config['seed'] = broadcast(config['seed'])
+        feasible = run_search(config)
+        if feasible:
+            for num_layers, structures in feasible.items():
+                for structure in structures:
+                    print(f"Feasible structure with {num_layers} multi-qubit instructions: {list(structure)}")
+
+    elif args.command == 'bench':
+        results = run_benchmarks(args.quick, args.select)
+        if args.output is not None:
+            save_results(results, args.output)
+        if args.baseline is None:
+            for name, result in results['benchmarks'].items():
+                print(f"{name:40s} {result['seconds']:.3e} s")
+            return
+
+        comparison = compare_results(results, load_results(args.baseline), args.tolerance, args.select)
+        for name, baseline_seconds, seconds, verdict in comparison:
+            print(f"{name:40s} {baseline_seconds:.3e} s -> {seconds:.3e} s  {verdict}")
+        if any(verdict == 'slower' for _, _, _, verdict in comparison):
+            sys.exit(1)  # lets scripts and CI fail on regressions
@@ -4,9 +4,127 @@
 This module contains unitary gate definitions.
 It should be modified for different quantum computer
 architectures.
+
+Controlled and cross-resonance gates on any placement are generated by make_gate from the small core
+gates in CORE_GATES; generated matrices are cached and read-only, so they can be shared freely.
 """
+from functools import lru_cache
 from math import sqrt
+from typing import Dict, Sequence, Tuple
 import numpy as np
+from .unitary import instruction_matrix
+
+
+def _controlled(gate: np.ndarray) -> np.ndarray:
+    """
+    Adds a control qubit, as most significant qubit, to a gate.
+
+    :param gate: 2^k x 2^k complex unitary
+    :return: 2^(k+1) x 2^(k+1) complex unitary
+    """
+    controlled = np.eye(2 * gate.shape[0], dtype=np.complex128)
+    controlled[gate.shape[0]:, gate.shape[0]:] = gate
+
+    return controlled
+
+
+_X = np.array([[0, 1], [1, 0]], dtype=np.complex128)
+_Y = np.array([[0, -1j], [1j, 0]], dtype=np.complex128)
+_CROSS_RESONANCE = np.kron(_X, np.eye(2)) - np.kron(_Y, _X)  # XI - YX
+
+# Core gates with their first qubit as control (first qubit most significant)
+CORE_GATES = {
+    'CX': _controlled(_X),
+    'CZ': _controlled(np.diag([1, -1])),
+    'CV': _controlled(np.array([[0.5+0.5j, 0.5-0.5j], [0.5-0.5j, 0.5+0.5j]])),  # controlled square root of X
+    'ECR': _CROSS_RESONANCE / sqrt(2),
+    'CR': (0.5-0.5j) * _CROSS_RESONANCE,  # the ECR gate with the global phase of ThreeGates.CR01
+    'ISWAP': np.array([
+        [1, 0, 0, 0],
+        [0, 0, 1j, 0],
+        [0, 1j, 0, 0],
+        [0, 0, 0, 1]
+    ], dtype=np.complex128),
+    'MCR': 0.5 * np.array([
+        [0, 0, 0, 0, 1, 1j, 1j, -1],
+        [0, 0, 0, 0, 1j, 1, -1, 1j],
+        [0, 0, 0, 0, 1j, -1, 1, 1j],
+        [0, 0, 0, 0, -1, 1j, 1j, 1],
+        [1, -1j, -1j, -1, 0, 0, 0, 0],
+        [-1j, 1, -1, -1j, 0, 0, 0, 0],
+        [-1j, -1, 1, -1j, 0, 0, 0, 0],
+        [-1, -1j, -1j, 1, 0, 0, 0, 0]
+    ], dtype=np.complex128),  # cross-resonance from qubit 0 to qubits 1 and 2 at once
+    'CCX': _controlled(_controlled(_X)),
+}
+for _core in CORE_GATES.values():
+    _core.flags.writeable = False
+
+
+def core_gate(name: str) -> np.ndarray:
+    """
+    Looks up a core gate.
+
+    :param name: key of CORE_GATES
+    :return: read-only 2^k x 2^k complex unitary
+    """
+    if name not in CORE_GATES:
+        raise Exception(f"Error: unknown gate {name}, expected one of {sorted(CORE_GATES)}")
+
+    return CORE_GATES[name]
+
+
+def _check_placement(name: str, qubits: Sequence[int], num_qubits: int) -> None:
+    size = core_gate(name).shape[0].bit_length() - 1
+    if len(qubits) != size:
+        raise Exception(f"Error: gate {name} acts on {size} qubits, got {len(qubits)}")
+    if len(set(qubits)) != len(qubits) or not all(0 <= qubit < num_qubits for qubit in qubits):
+        raise Exception(f"Error: invalid qubits {tuple(qubits)} for {num_qubits} qubits")
+
+
+@lru_cache(maxsize=1024)
+def _make_gate(name: str, qubits: Tuple[int, ...], num_qubits: int) -> np.ndarray:
+    _check_placement(name, qubits, num_qubits)
+    matrix = instruction_matrix((core_gate(name), qubits), num_qubits)
+    matrix.flags.writeable = False
+
+    return matrix
+
+
+def make_gate(name: str, qubits: Sequence[int], num_qubits: int) -> np.ndarray:
+    """
+    Generates a core gate placed on some qubits of a register, e.g. make_gate('CX', (2, 0), 3) for the
+    CX gate with qubit 2 as control and qubit 0 as target. Results are cached.
+
+    :param name: key of CORE_GATES
+    :param qubits: qubits the core gate acts on, in the order of its qubits (controls first)
+    :param num_qubits: number of qubits of the register
+    :return: read-only 2^num_qubits x 2^num_qubits complex unitary
+    """
+    return _make_gate(name, tuple(int(qubit) for qubit in qubits), num_qubits)
+
+
+def build_mq_dict(coupling_map: Sequence[Sequence[int]], name: str = 'CX', num_qubits: int = None,
+                  local: bool = False) -> Dict[int, object]:
+    """
+    Builds the multi-qubit instructions of a device: one core gate per entry of its coupling map.
+
+    :param coupling_map: sequence of qubit tuples the gate may act on, e.g. [(0, 1), (1, 2)] for CX gates
+    with a linear connectivity controlled by the lower qubit
+    :param name: key of CORE_GATES
+    :param num_qubits: number of qubits of the register (default: one more than the largest qubit)
+    :param local: if True, instructions are (gate, qubits) pairs applied by local contraction instead of
+    full matrices, which scales to larger registers
+    :return: dictionary mapping integers [0, len(coupling_map)) to instructions
+    """
+    if num_qubits is None:
+        num_qubits = max(max(qubits) for qubits in coupling_map) + 1
+    if local:
+        for qubits in coupling_map:
+            _check_placement(name, qubits, num_qubits)
+        return {index: (core_gate(name), tuple(qubits)) for index, qubits in enumerate(coupling_map)}
+
+    return {index: make_gate(name, qubits, num_qubits) for index, qubits in enumerate(coupling_map)}
 
 
 class TwoGates:
@@ -20,14 +138,10 @@ class TwoGates:
         [0, 0, -0.5-0.5j, -0.5+0.5j],
         [-0.5+0.5j, 0.5+0.5j, 0, 0],
         [0.5+0.5j, -0.5+0.5j, 0, 0]
-    ], dtype=np.complex128)
+    ], dtype=np.complex128)  # make_gate('CR', (0, 1), 2) with global phase -1
 
-    CX01 = np.array([
-        [1, 0, 0, 0],
-        [0, 1, 0, 0],
-        [0, 0, 0, 1],
-        [0, 0, 1, 0]
-    ], dtype=np.complex128)
+    CX01 = make_gate('CX', (0, 1), 2)
+    CX10 = make_gate('CX', (1, 0), 2)
 
     GHZ = np.array([
         [1/sqrt(2), 0, 1/sqrt(2), 0],
@@ -43,104 +157,30 @@ class ThreeGates:
     that implement IBM Q native gates (or proposed native gates)
     or produce common entangled states (e.g., the GHZ state).
     """
-    CR01 = np.array([
-        [0, 0, 0, 0, 0.5-0.5j, 0, 0.5+0.5j, 0],
-        [0, 0, 0, 0, 0, 0.5-0.5j, 0, 0.5+0.5j],
-        [0, 0, 0, 0, 0.5+0.5j, 0, 0.5-0.5j, 0],
-        [0, 0, 0, 0, 0, 0.5+0.5j, 0, 0.5-0.5j],
-        [0.5-0.5j, 0, -0.5-0.5j, 0, 0, 0, 0, 0],
-        [0, 0.5-0.5j, 0, -0.5-0.5j, 0, 0, 0, 0],
-        [-0.5-0.5j, 0, 0.5-0.5j, 0, 0, 0, 0, 0],
-        [0, -0.5-0.5j, 0, 0.5-0.5j, 0, 0, 0, 0]
-    ], dtype=np.complex128)
-
-    CR02 = np.array([
-        [0, 0, 0, 0, 0.5-0.5j, 0.5+0.5j, 0, 0],
-        [0, 0, 0, 0, 0.5+0.5j, 0.5-0.5j, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0.5-0.5j, 0.5+0.5j],
-        [0, 0, 0, 0, 0, 0, 0.5+0.5j, 0.5-0.5j],
-        [0.5-0.5j, -0.5-0.5j, 0, 0, 0, 0, 0, 0],
-        [-0.5-0.5j, 0.5-0.5j, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0.5-0.5j, -0.5-0.5j, 0, 0, 0, 0],
-        [0, 0, -0.5-0.5j, 0.5-0.5j, 0, 0, 0, 0]
-    ], dtype=np.complex128)
-
-    MCR = np.array([
-        [0, 0, 0, 0, 0.5, 0.5j, 0.5j, -0.5],
-        [0, 0, 0, 0, 0.5j, 0.5, -0.5, 0.5j],
-        [0, 0, 0, 0, 0.5j, -0.5, 0.5, 0.5j],
-        [0, 0, 0, 0, -0.5, 0.5j, 0.5j, 0.5],
-        [0.5, -0.5j, -0.5j, -0.5, 0, 0, 0, 0],
-        [-0.5j, 0.5, -0.5, -0.5j, 0, 0, 0, 0],
-        [-0.5j, -0.5, 0.5, -0.5j, 0, 0, 0, 0],
-        [-0.5, -0.5j, -0.5j, 0.5, 0, 0, 0, 0]
-    ], dtype=np.complex128)
-
-    CV01 = np.array([
-        [1, 0, 0, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0.5+0.5j, 0, 0.5-0.5j, 0],
-        [0, 0, 0, 0, 0, 0.5+0.5j, 0, 0.5-0.5j],
-        [0, 0, 0, 0, 0.5-0.5j, 0, 0.5+0.5j, 0],
-        [0, 0, 0, 0, 0, 0.5-0.5j, 0, 0.5+0.5j]
-    ], dtype=np.complex128)
-
-    CV02 = np.array([
-        [1, 0, 0, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0.5+0.5j, 0.5-0.5j, 0, 0],
-        [0, 0, 0, 0, 0.5-0.5j, 0.5+0.5j, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0.5+0.5j, 0.5-0.5j],
-        [0, 0, 0, 0, 0, 0, 0.5-0.5j, 0.5+0.5j]
-    ], dtype=np.complex128)
-
-    CX01 = np.array([
-        [1, 0, 0, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 1, 0],
-        [0, 0, 0, 0, 0, 0, 0, 1],
-        [0, 0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0, 0]
-    ], dtype=np.complex128)
-
-    CX02 = np.array([
-        [1, 0, 0, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0, 0],
-        [0, 0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 1],
-        [0, 0, 0, 0, 0, 0, 1, 0]
-    ], dtype=np.complex128)
-
-    CX12 = np.array([
-        [1, 0, 0, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 1],
-        [0, 0, 0, 0, 0, 0, 1, 0]
-    ], dtype=np.complex128)
-
-    TOFFOLI = np.array([
-        [1, 0, 0, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0, 0],
-        [0, 0, 0, 0, 0, 0, 0, 1],
-        [0, 0, 0, 0, 0, 0, 1, 0]
-    ], dtype=np.complex128)  # Toffoli gate unitary matrix
+    MCR = make_gate('MCR', (0, 1, 2), 3)
+
+    CR01 = make_gate('CR', (0, 1), 3)
+    CR02 = make_gate('CR', (0, 2), 3)
+    CR10 = make_gate('CR', (1, 0), 3)
+    CR12 = make_gate('CR', (1, 2), 3)
+    CR20 = make_gate('CR', (2, 0), 3)
+    CR21 = make_gate('CR', (2, 1), 3)
+
+    CV01 = make_gate('CV', (0, 1), 3)
+    CV02 = make_gate('CV', (0, 2), 3)
+    CV10 = make_gate('CV', (1, 0), 3)
+    CV12 = make_gate('CV', (1, 2), 3)
+    CV20 = make_gate('CV', (2, 0), 3)
+    CV21 = make_gate('CV', (2, 1), 3)
+
+    CX01 = make_gate('CX', (0, 1), 3)
+    CX02 = make_gate('CX', (0, 2), 3)
+    CX10 = make_gate('CX', (1, 0), 3)
+    CX12 = make_gate('CX', (1, 2), 3)
+    CX20 = make_gate('CX', (2, 0), 3)
+    CX21 = make_gate('CX', (2, 1), 3)
+
+    TOFFOLI = make_gate('CCX', (0, 1, 2), 3)  # Toffoli gate unitary matrix
 
     GHZ = -(1 / sqrt(2)) * np.array([
         [1, 0, 0, 0, 1, 0, 0, 0],
@@ -153,3 +193,16 @@ class ThreeGates:
         [1, 0, 0, 0, -1, 0, 0, 0]
     ], dtype=np.complex128)  # GHZ prep circuit unitary matrix (to global phase)
 
+
+def controlled_x(num_qubits: int) -> np.ndarray:
+    """
+    Generates the multi-controlled X gate (CX, Toffoli, C3X, ...) with qubits 0 to num_qubits - 2 as
+    controls and the last qubit as target, e.g. as a target for searches beyond three qubits.
+
+    :param num_qubits: total number of qubits, at least 2
+    :return: 2^num_qubits x 2^num_qubits complex unitary matrix
+    """
+    gate = np.eye(2 ** num_qubits, dtype=np.complex128)
+    gate[-2:, -2:] = np.array([[0, 1], [1, 0]])
+
+    return gate
@@ -4,44 +4,128 @@
 This module contains tools for discovering quantum circuit implementations of quantum gates/circuits
 using numerical optimization techniques.
 """
-from typing import Dict, List, Tuple
-import multiprocessing
+from typing import Callable, Dict, List, Tuple
+import time
 import numpy as np
 from scipy.optimize import minimize, least_squares
+from .stats import OptimizerStats, new_counters, timed
 from .unitary import UnitaryBuilder
+from .utils import get_unitary_infidelity
+
+
+def _nice_angle_derivatives(params: np.ndarray) -> np.ndarray:
+    """
+    Derivative of the nice-angle residual sin(6x) sin(4x) sin(2x)^2 with respect to x.
+
+    :param params: Numpy array of angles
+    :return: Numpy array of derivatives, one per angle
+    """
+    return (6 * np.cos(6 * params) * np.sin(4 * params) * np.sin(2 * params) ** 2
+            + 4 * np.sin(6 * params) * np.cos(4 * params) * np.sin(2 * params) ** 2
+            + 4 * np.sin(6 * params) * np.sin(4 * params) * np.sin(2 * params) * np.cos(2 * params))
+
+
+class StartInterrupted(Exception):
+    """
+    Raised by Optimizer.run_least_squares when its interrupt callback asks to abandon the start.
+    """
+
+
+def _interruptible(residuals: Callable, interrupt: Callable[[], bool]) -> Callable:
+    """
+    Wraps a residual function so that a start can be abandoned between solver iterations.
+
+    :param residuals: residual function
+    :param interrupt: function without arguments returning True once the start should stop
+    :return: wrapped function raising StartInterrupted
+    """
+    def wrapper(*args):
+        if interrupt():
+            raise StartInterrupted("Error: least-squares start interrupted")
+        return residuals(*args)
+
+    return wrapper
 
 
 class Optimizer:
     def __init__(self, num_qubits: int, mq_instructions: List[int], mq_dict: Dict[int, np.ndarray], target: np.ndarray,
-            alpha: float, gamma: float, non_fixed_params: np.ndarray, fixed_params_vals: np.ndarray):
+            alpha: float, gamma: float, non_fixed_params: np.ndarray, fixed_params_vals: np.ndarray,
+            precision: str = 'double', polish_threshold: float = 1e-4, stats: OptimizerStats = None):
         """
         Constructor for Optimizer class.
 
+        With precision 'mixed', every least-squares start first runs on complex64 unitaries to a loose
+        tolerance, and only starts that screen below polish_threshold are refined on complex128
+        unitaries to the final tolerance. Reported costs are always evaluated in double precision.
+
+        Given a stats collector, every least-squares start (also those run by a MultistartPool) is
+        recorded in it, see OptimizerStats.
+
         :param num_qubits: number of qubits used by target operation
         :param mq_instructions: a list of multi-qubit instructions defining circuit structure to optimize over
         :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+        (or to (2^k x 2^k unitary, tuple of k qubits) pairs, see UnitaryBuilder)
         :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+        :param alpha: weight of the penalty for non-standard angles
+        :param gamma: weight of the penalty for large angles
+        :param non_fixed_params: 0/1 Numpy array marking the parameters the optimizer may change
+        :param fixed_params_vals: Numpy array of values taken by the fixed parameters (and added to the free ones)
+        :param precision: 'double' or 'mixed'
+        :param polish_threshold: screening cost below which a start is refined in double precision ('mixed' only)
+        :param stats: optional OptimizerStats collecting per-start statistics
         """
+        if precision not in ('double', 'mixed'):
+            raise Exception("Error: precision must be 'double' or 'mixed'")
+
         self.num_qubits = num_qubits
         self.mq_instructions = mq_instructions
         self.mq_dict = mq_dict
         self.target = target
-        self.unitary_builder = UnitaryBuilder(num_qubits, mq_instructions, mq_dict)
+        self.unitary_builder = UnitaryBuilder(num_qubits, mq_instructions, mq_dict, non_fixed_params, fixed_params_vals)
         self.alpha = alpha
         self.gamma = gamma
         self.non_fixed_params = non_fixed_params
         self.fixed_params_vals = fixed_params_vals
+        self.free_indices = np.flatnonzero(non_fixed_params)
+        self.num_free_params = len(self.free_indices)
+        self.precision = precision
+        self.polish_threshold = polish_threshold
+        self.stats = stats
+        if precision == 'mixed':
+            self.screening_builder = UnitaryBuilder(num_qubits, mq_instructions, mq_dict, non_fixed_params,
+                                                    fixed_params_vals, dtype=np.complex64)
+            self.screening_target = np.asarray(target, dtype=np.complex64)
+
+    def unpack_params(self, params: np.ndarray) -> np.ndarray:
+        """
+        Scatters a vector of free parameters into a full circuit parameter vector.
+
+        :param params: Numpy array with one entry per free parameter
+        :return: Numpy array of parameters completing quantum circuit specification in unitary_builder
+        """
+        actual_params = np.array(self.fixed_params_vals, dtype=np.float64)
+        actual_params[self.free_indices] += params
+
+        return actual_params
+
+    def pack_params(self, actual_params: np.ndarray) -> np.ndarray:
+        """
+        Gathers the free parameters of a full circuit parameter vector (inverse of unpack_params).
+
+        :param actual_params: Numpy array of parameters completing quantum circuit specification in unitary_builder
+        :return: Numpy array with one entry per free parameter
+        """
+        return actual_params[self.free_indices] - self.fixed_params_vals[self.free_indices]
 
     def bfgs_objective_function(self, params: np.ndarray) -> float:
         """
         Calculates a cost measuring how close the parameter-calculated unitary matches the target unitary,
         how large the parameters are, and how "ideal" the angle measures are (i.e., are common angles such as pi/6, pi/4, etc.).
 
-        :param params: Numpy array of parameters completing quantum circuit specification in unitary_builder
+        :param params: Numpy array of free parameters completing quantum circuit specification in unitary_builder
         :return: a floating point number
         """
-        actual_params = np.multiply(self.non_fixed_params, params) + self.fixed_params_vals
-        # actual_params = params
+        actual_params = self.unpack_params(params)
 
         complex_residuals = np.matrix.flatten(self.unitary_builder.build_unitary(actual_params) - self.target)
         unitary_cost = np.vdot(complex_residuals, complex_residuals).real
@@ -51,17 +135,35 @@ class Optimizer:
 
         return unitary_cost + nice_angle_cost + large_angle_cost
 
-    def least_square_residuals(self, params: np.ndarray) -> np.ndarray:
+    def bfgs_gradient(self, params: np.ndarray) -> np.ndarray:
+        """
+        Calculates the exact gradient of bfgs_objective_function with respect to params.
+
+        :param params: Numpy array of free parameters completing quantum circuit specification in unitary_builder
+        :return: Numpy array with one partial derivative per parameter
+        """
+        actual_params = self.unpack_params(params)
+
+        complex_residuals = self.unitary_builder.build_unitary(actual_params) - self.target
+        unitary_gradient = self.unitary_builder.unitary_gradient(actual_params, 2 * complex_residuals)
+        nice_angle_residuals = np.sin(6 * actual_params) * np.sin(4 * actual_params) * np.sin(2 * actual_params) * np.sin(2 * actual_params)
+        nice_angle_gradient = 2 * self.alpha * nice_angle_residuals * _nice_angle_derivatives(actual_params)
+        large_angle_gradient = 2 * self.gamma * params
+
+        return (unitary_gradient + nice_angle_gradient)[self.free_indices] + large_angle_gradient
+
+    def least_square_residuals(self, params: np.ndarray, single_precision: bool = False) -> np.ndarray:
         """
         Calculates a list of residuals interpreted by SciPy LM optimizer
 
-        :param params: Numpy array of parameters completing quantum circuit specification in unitary_builder
+        :param params: Numpy array of free parameters completing quantum circuit specification in unitary_builder
+        :param single_precision: build the unitary in complex64 (precision 'mixed' only)
         :return: an array of least-squares residuals (unsquared)
         """
-        actual_params = np.multiply(self.non_fixed_params, params) + self.fixed_params_vals
-        # print(actual_params)
+        actual_params = self.unpack_params(params)
+        unitary_builder, target = self._precision_pair(single_precision)
 
-        complex_residuals = np.matrix.flatten(self.unitary_builder.build_unitary(actual_params) - self.target)
+        complex_residuals = np.matrix.flatten(unitary_builder.build_unitary(actual_params) - target)
         real_residuals = np.hstack((complex_residuals.real, complex_residuals.imag))
         angle_conform_residuals = self.alpha * (np.sin(6 * params)
                                           * np.sin(4 * params) * np.sin(2 * params)
@@ -73,34 +175,204 @@ class Optimizer:
         # return real_and_angle_conform_residuals
         return all_residuals
 
-    def find_parameters_bfgs(self, num_guesses: int) -> Tuple[np.ndarray, float]:
+    def least_square_jacobian(self, params: np.ndarray, single_precision: bool = False) -> np.ndarray:
+        """
+        Calculates the exact Jacobian of least_square_residuals with respect to params.
+
+        :param params: Numpy array of free parameters completing quantum circuit specification in unitary_builder
+        :param single_precision: differentiate the unitary in complex64 (precision 'mixed' only)
+        :return: a (2 * 4^num_qubits + 2 * len(params)) x len(params) real matrix
+        """
+        actual_params = self.unpack_params(params)
+        unitary_builder, _ = self._precision_pair(single_precision)
+
+        _, unitary_jacobian = unitary_builder.unitary_jacobian(actual_params, self.free_indices)
+        complex_jacobian = unitary_jacobian.reshape(len(params), -1).T
+        real_jacobian = np.vstack((complex_jacobian.real, complex_jacobian.imag))
+        angle_conform_derivatives = self.alpha * _nice_angle_derivatives(params)
+        large_angle_derivatives = 2 * self.gamma * params
+
+        return np.vstack((real_jacobian, np.diag(angle_conform_derivatives), np.diag(large_angle_derivatives)))
+
+    def _precision_pair(self, single_precision: bool) -> Tuple[UnitaryBuilder, np.ndarray]:
+        """
+        Selects the unitary builder and target of the requested precision.
+
+        :param single_precision: True for the complex64 screening pair
+        :return: tuple of a UnitaryBuilder and the target matrix
         """
-        Run BFGS optimization routing num_guesses times on the quantum circuit structure
-        specified in construction of this object.
+        if single_precision:
+            return self.screening_builder, self.screening_target
+
+        return self.unitary_builder, self.target
+
+    def find_parameters_bfgs(self, num_guesses: int, method: str = 'BFGS',
+                             bounds: Tuple[float, float] = (-2 * np.pi, 2 * np.pi), seed: int = None) -> Tuple[np.ndarray, float]:
+        """
+        Run quasi-Newton optimization num_guesses times on the quantum circuit structure
+        specified in construction of this object, using the analytic gradient of the BFGS objective.
 
         :param num_guesses: integer for number of random points from which to run BFGS
+        :param method: 'BFGS' for unconstrained optimization or 'L-BFGS-B' for bounded angles
+        :param bounds: (lower, upper) bound applied to every parameter when method is 'L-BFGS-B'
+        :param seed: seed of the random starting points (fresh entropy if None)
         :return: Numpy array of parameters that minimize BFGS objective function
         """
+        if method not in ('BFGS', 'L-BFGS-B'):
+            raise Exception(f"Error: unsupported quasi-Newton method {method}")
+
         min_fun_val = np.inf
         min_params = None
+        param_bounds = [bounds] * self.num_free_params if method == 'L-BFGS-B' else None
 
-        for i in range(num_guesses):
-            x0_all = np.random.rand((len(self.mq_instructions) + 1) * 3 * self.num_qubits) * 2 * np.pi
-            x0 = np.multiply(x0_all, self.non_fixed_params) + self.fixed_params_vals
-            opt_results = minimize(self.objective_function_bfgs, x0=x0, method='BFGS', options={'disp': False})
-            # print(f"Test {i}: {opt_results.fun}")
+        for seed_sequence in np.random.SeedSequence(seed).spawn(num_guesses):
+            x0 = self.random_start(seed_sequence)
+            opt_results = minimize(self.bfgs_objective_function, x0=x0, jac=self.bfgs_gradient, method=method,
+                                   bounds=param_bounds, options={'disp': False})
             if opt_results.fun < min_fun_val:
                 min_fun_val = opt_results.fun
-                min_params = np.multiply(opt_results.x, self.non_fixed_params) + self.fixed_params_vals
+                min_params = self.unpack_params(opt_results.x)
 
         return min_params, min_fun_val
 
+    def reached_threshold(self, params: np.ndarray, cost: float, cost_threshold: float = None,
+                          infidelity_threshold: float = None) -> bool:
+        """
+        Checks whether a multistart result is good enough to stop searching.
+
+        :param params: Numpy array of parameters completing quantum circuit specification in unitary_builder
+        :param cost: least-squares cost reached by params
+        :param cost_threshold: stop once the cost is at most this value (ignored if None)
+        :param infidelity_threshold: stop once the unitary infidelity to the target is at most this value (ignored if None)
+        :return: True if either threshold is met
+        """
+        if params is None:
+            return False
+        if cost_threshold is not None and cost <= cost_threshold:
+            return True
+        if infidelity_threshold is not None:
+            implementation_matrix = self.unitary_builder.build_unitary(params)
+            return get_unitary_infidelity(self.target, implementation_matrix, self.unitary_builder.dim) <= infidelity_threshold
+
+        return False
+
+    def run_least_squares(self, x0: np.ndarray, max_nfev: int = None,
+                          interrupt: Callable[[], bool] = None) -> Tuple[np.ndarray, float, int]:
+        """
+        Run trust region-based optimization once from a given point, and record it if the optimizer
+        collects statistics.
+
+        :param x0: Numpy array of free parameters to start from
+        :param max_nfev: maximum number of residual evaluations (solver default if None)
+        :param interrupt: optional function checked before every residual evaluation; once it returns True
+        the start is abandoned by raising StartInterrupted
+        :return: tuple of the full optimized parameter vector, its least-squares cost and the number of residual evaluations
+        """
+        if self.stats is None:
+            return self._run_least_squares(x0, max_nfev, interrupt=interrupt)[:3]
+
+        counters = new_counters()
+        start_time = time.perf_counter()
+        params, cost, nfev, termination = self._run_least_squares(x0, max_nfev, counters, interrupt)
+        self.stats.add_start(self, params, cost, termination, time.perf_counter() - start_time, counters)
+
+        return params, cost, nfev
+
+    def _run_least_squares(self, x0: np.ndarray, max_nfev: int = None, counters: Dict[str, float] = None,
+                           interrupt: Callable[[], bool] = None) -> Tuple[np.ndarray, float, int, Dict[str, object]]:
+        """
+        Body of run_least_squares.
+
+        :param x0: Numpy array of free parameters to start from
+        :param max_nfev: maximum number of residual evaluations (solver default if None)
+        :param counters: optional evaluation counters (see stats.new_counters) to count and time evaluations in
+        :param interrupt: optional function checked before every residual evaluation (see run_least_squares)
+        :return: tuple of the full optimized parameter vector, its least-squares cost, the number of residual
+        evaluations and a dictionary with the solver status, message and iterations and whether the start
+        was refined in double precision
+        """
+        residuals, jacobian = self.least_square_residuals, self.least_square_jacobian
+        if counters is not None:
+            residuals, jacobian = timed(residuals, 'residual', counters), timed(jacobian, 'jacobian', counters)
+        if interrupt is not None:
+            residuals = _interruptible(residuals, interrupt)
+
+        if self.num_free_params == 0:  # nothing to optimize, e.g. a single instruction between fixed layers
+            termination = {'status': 0, 'message': 'No free parameters.', 'iterations': 0, 'refined': False}
+            return self.unpack_params(x0), 0.5 * np.sum(residuals(x0) ** 2), 1, termination
+
+        nfev = 0
+        iterations = 0
+        if self.precision == 'mixed':
+            # Single precision cannot resolve costs much below 1e-7, so the screening tolerances are loose
+            opt_results = least_squares(residuals, x0=x0, jac=jacobian, method='lm', verbose=0, ftol=1e-6,
+                                        xtol=1e-6, max_nfev=max_nfev, args=(True, ))
+            x0 = opt_results.x
+            nfev = opt_results.nfev
+            iterations = opt_results.njev  # MINPACK evaluates the Jacobian once per iteration
+            if opt_results.cost > self.polish_threshold or (max_nfev is not None and nfev >= max_nfev):
+                termination = {'status': opt_results.status, 'message': opt_results.message,
+                               'iterations': iterations, 'refined': False}
+                return self.unpack_params(x0), 0.5 * np.sum(residuals(x0) ** 2), nfev + 1, termination
+            if max_nfev is not None:
+                max_nfev -= nfev
+
+        opt_results = least_squares(residuals, x0=x0, jac=jacobian, method='lm', verbose=0, ftol=1e-15,
+                                    max_nfev=max_nfev)
+        termination = {'status': opt_results.status, 'message': opt_results.message,
+                       'iterations': iterations + opt_results.njev, 'refined': self.precision == 'mixed'}
+
+        return self.unpack_params(opt_results.x), opt_results.cost, nfev + opt_results.nfev, termination
+
+    def random_start(self, seed_sequence: np.random.SeedSequence) -> np.ndarray:
+        """
+        Draws a uniformly random starting point in [0, 2 pi) for the free parameters.
+
+        :param seed_sequence: seed of the random stream owned by this start
+        :return: Numpy array of free parameters
+        """
+        return np.random.default_rng(seed_sequence).random(self.num_free_params) * 2 * np.pi
+
+    def start_points(self, num_guesses: int, seed: int = None,
+                     initial_guesses: List[np.ndarray] = None) -> List[object]:
+        """
+        Lists the starting points of a multistart run: the given initial guesses (as free parameter
+        vectors) first, then seed sequences for random starts. Start i always owns the i-th child of
+        SeedSequence(seed), so adding guesses does not change the random points of the later starts.
 
-    def find_parameters_least_squares(self, num_guesses: int) -> Tuple[np.ndarray, float]:
+        :param num_guesses: total number of starts
+        :param seed: seed (or SeedSequence) of the random starting points (fresh entropy if None)
+        :param initial_guesses: optional list of full parameter vectors to start from before the random starts
+        :return: list of num_guesses entries, each a Numpy array of free parameters or a SeedSequence
         """
-        Sequentially run trust region-based optimization num_guesses times.
+        initial_guesses = [] if initial_guesses is None else initial_guesses[:num_guesses]
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        starts = seed_sequence.spawn(num_guesses)
+        for index, guess in enumerate(initial_guesses):
+            starts[index] = self.pack_params(np.asarray(guess, dtype=np.float64))
+
+        return starts
+
+    def find_parameters_least_squares(self, num_guesses: int, cost_threshold: float = None,
+                                      infidelity_threshold: float = None, time_budget: float = None,
+                                      max_evaluations: int = None, seed: int = None,
+                                      initial_guesses: List[np.ndarray] = None) -> Tuple[np.ndarray, float]:
+        """
+        Sequentially run trust region-based optimization up to num_guesses times, stopping early once
+        a start meets cost_threshold or infidelity_threshold or a budget is exhausted. A start still
+        running when time_budget expires is abandoned at its next residual evaluation. Start i draws its
+        initial point from the i-th child of SeedSequence(seed), so without a time budget a seeded run
+        gives the same result as find_parameters_least_squares_par with any number of processes. Initial
+        guesses (e.g. solutions of neighbouring structures) replace the first random starts.
 
         :param num_guesses: integer
+        :param cost_threshold: stop once a start reaches a least-squares cost at most this value
+        :param infidelity_threshold: stop once a start reaches a unitary infidelity at most this value
+        :param time_budget: wall-clock seconds after which the running start is abandoned (at its next
+        residual evaluation)
+        :param max_evaluations: total number of residual evaluations over all starts
+        :param seed: seed of the random starting points (fresh entropy if None)
+        :param initial_guesses: optional list of full parameter vectors tried before the random starts
         :return: Numpy array of parameters that minimize least-squares objective function
         """
         min_fun_val = np.inf
@@ -109,36 +381,65 @@ class Optimizer:
         if num_guesses == 0:
             return min_params, min_fun_val
 
-        for _ in range(num_guesses):
-            x0_all = np.random.rand((len(self.mq_instructions) + 1) * 3 * self.num_qubits) * 2 * np.pi
-            x0 = np.multiply(x0_all, self.non_fixed_params) + self.fixed_params_vals
-            opt_results = least_squares(self.least_square_residuals, x0=x0, method='lm', verbose=0, ftol=1e-15)
-            if opt_results.cost < min_fun_val:
-                min_fun_val = opt_results.cost
-                min_params = np.multiply(opt_results.x, self.non_fixed_params) + self.fixed_params_vals
+        interrupt = None
+        if time_budget is not None:
+            deadline = time.perf_counter() + time_budget
+            interrupt = lambda: time.perf_counter() >= deadline
+        evaluations = 0
+        for start in self.start_points(num_guesses, seed, initial_guesses):
+            if interrupt is not None and interrupt():
+                break
+            max_nfev = None if max_evaluations is None else max_evaluations - evaluations
+            if max_nfev is not None and max_nfev <= 0:
+                break
+
+            x0 = self.random_start(start) if isinstance(start, np.random.SeedSequence) else start
+            try:
+                params, cost, nfev = self.run_least_squares(x0, max_nfev, interrupt)
+            except StartInterrupted:
+                break
+            evaluations += nfev
+            if cost < min_fun_val:
+                min_fun_val = cost
+                min_params = params
+            if self.reached_threshold(params, cost, cost_threshold, infidelity_threshold):
+                break
 
         return min_params, min_fun_val
 
-    def find_parameters_least_squares_par(self, num_guesses: int, procs: int) -> Tuple[np.ndarray, float]:
+    def find_parameters_least_squares_par(self, num_guesses: int, procs: int, cost_threshold: float = None,
+                                          infidelity_threshold: float = None, time_budget: float = None,
+                                          max_evaluations: int = None, seed: int = None,
+                                          pool: 'MultistartPool' = None,
+                                          initial_guesses: List[np.ndarray] = None) -> Tuple[np.ndarray, float]:
         """
-        Run trust region-based optimization num_guesses times using parallel processes.
+        Run trust region-based optimization num_guesses times using parallel processes. Starts are handed
+        to the processes one at a time; once a start meets a threshold or a budget is exhausted, the
+        outstanding starts are cancelled. Every start carries its own random stream (see
+        find_parameters_least_squares) and results are consumed in start order, so without a time budget
+        the result does not depend on procs.
 
         :param num_guesses: integer
-        :param procs: integer number of processes to spawn (procs + 1 may also be spawned)
+        :param procs: integer number of processes to spawn (ignored if pool is given)
+        :param cost_threshold: stop once a start reaches a least-squares cost at most this value
+        :param infidelity_threshold: stop once a start reaches a unitary infidelity at most this value
+        :param time_budget: wall-clock seconds after which running starts are abandoned (at their next
+        residual evaluation)
+        :param max_evaluations: total number of residual evaluations over all starts, enforced as in
+        find_parameters_least_squares
+        :param seed: seed of the random starting points (fresh entropy if None)
+        :param pool: optional MultistartPool to reuse across calls instead of spawning new processes
+        :param initial_guesses: optional list of full parameter vectors tried before the random starts
         :return: Numpy array of parameters that minimize least-squares objective function
         """
-        min_fun_val = np.inf
-        min_params = None
-
-        with multiprocessing.Pool(procs + 1) as proc_pool:
-            task_guesses = [int(num_guesses / procs)] * procs + [num_guesses % procs]
-            results = [proc_pool.apply_async(self.find_parameters_least_squares, (guesses, )) for guesses in task_guesses]
+        from .parallel import MultistartPool
 
-            for result in results:
-                result_tuple = result.get()
-                if result_tuple[1] < min_fun_val:
-                    min_fun_val = result_tuple[1]
-                    min_params = result_tuple[0]  # find minimum parameters across all processes
-
-        return min_params, min_fun_val
+        if pool is not None:
+            return pool.find_parameters_least_squares(self, num_guesses, cost_threshold, infidelity_threshold,
+                                                      time_budget, max_evaluations, seed,
+                                                      initial_guesses=initial_guesses)
 
+        with MultistartPool(procs, self.num_qubits, self.mq_dict, self.target) as proc_pool:
+            return proc_pool.find_parameters_least_squares(self, num_guesses, cost_threshold, infidelity_threshold,
+                                                           time_budget, max_evaluations, seed,
+                                                           initial_guesses=initial_guesses)
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains tools for running circuit optimization in parallel: a persistent process pool
+for multistart optimization over many circuit structures, and a load-balanced task distributor that
+uses MPI when available and local processes otherwise.
+"""
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import multiprocessing
+import time
+import numpy as np
+from .optimizer import Optimizer, StartInterrupted
+from .stats import OptimizerStats
+from .unitary import instruction_matrix
+
+_worker_state = {}
+_RESULT_TAG = 1
+_TASK_TAG = 2
+
+
+def _init_worker(num_qubits: int, mq_dict: Dict[int, np.ndarray], target: np.ndarray, cancelled) -> None:
+    """
+    Pool initializer: receives the gate tables and target once per worker process.
+
+    :param num_qubits: number of qubits used by target operation
+    :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+    :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+    :param cancelled: shared integer holding the id of the most recent cancelled call
+    """
+    _worker_state['num_qubits'] = num_qubits
+    _worker_state['mq_dict'] = mq_dict
+    _worker_state['target'] = target
+    _worker_state['cancelled'] = cancelled
+    _worker_state['optimizer_key'] = None
+
+
+def _run_start(task: tuple):
+    """
+    Runs one least-squares start inside a worker process, reusing the Optimizer of the previous
+    task when it belongs to the same structure.
+
+    :param task: (call id, structure, alpha, gamma, non_fixed_params, fixed_params_vals, (precision, polish
+    threshold, collect stats), start, max_nfev), where start is a seed sequence for a random start or a Numpy
+    array of free parameters and max_nfev caps the residual evaluations of the start (None for no cap)
+    :return: (parameters, cost, evaluations, statistics record or None), or None if the call was cancelled
+    before the start finished
+    """
+    call_id, structure, alpha, gamma, non_fixed_params, fixed_params_vals, optimizer_options, start, max_nfev = task
+    cancelled = _worker_state['cancelled']
+    if cancelled.value >= call_id:
+        return None
+
+    key = (structure, alpha, gamma, non_fixed_params.tobytes(), fixed_params_vals.tobytes(), optimizer_options)
+    if _worker_state['optimizer_key'] != key:
+        precision, polish_threshold, collect_stats = optimizer_options
+        _worker_state['optimizer'] = Optimizer(_worker_state['num_qubits'], list(structure), _worker_state['mq_dict'],
+                                               _worker_state['target'], alpha, gamma, non_fixed_params,
+                                               fixed_params_vals, precision, polish_threshold,
+                                               OptimizerStats() if collect_stats else None)
+        _worker_state['optimizer_key'] = key
+    optimizer = _worker_state['optimizer']
+
+    x0 = optimizer.random_start(start) if isinstance(start, np.random.SeedSequence) else start
+    try:
+        # A cancelled call frees the worker at the next residual evaluation instead of after convergence
+        params, cost, nfev = optimizer.run_least_squares(x0, max_nfev, interrupt=lambda: cancelled.value >= call_id)
+    except StartInterrupted:
+        return None
+
+    return params, cost, nfev, optimizer.stats.records.pop() if optimizer.stats is not None else None
+
+
+class MultistartPool:
+    def __init__(self, procs: int, num_qubits: int, mq_dict: Dict[int, np.ndarray], target: np.ndarray):
+        """
+        Constructor for MultistartPool class. Starts procs worker processes and sends them the gate
+        tables and target once; afterwards only structures, masks and seeds travel per start, so the
+        same pool can serve a whole structure sweep.
+
+        :param procs: integer number of worker processes
+        :param num_qubits: number of qubits used by target operation
+        :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+        :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+        """
+        self.procs = procs
+        self.num_qubits = num_qubits
+        self.mq_dict = mq_dict
+        self.target = target
+        self._cancelled = multiprocessing.Value('l', 0)
+        self._call_id = 0
+        self._pool = multiprocessing.Pool(procs, initializer=_init_worker,
+                                          initargs=(num_qubits, mq_dict, target, self._cancelled))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Terminates the worker processes.
+        """
+        self._pool.terminate()
+        self._pool.join()
+
+    def _check_compatible(self, optimizer: Optimizer) -> None:
+        """
+        Makes sure an Optimizer uses the gate tables and target the workers were started with.
+
+        :param optimizer: Optimizer whose structure is to be optimized by the pool
+        """
+        if optimizer.num_qubits != self.num_qubits or not np.array_equal(optimizer.target, self.target):
+            raise Exception("Error: optimizer target does not match pool target")
+        if optimizer.mq_dict is not self.mq_dict and (
+                optimizer.mq_dict.keys() != self.mq_dict.keys()
+                or any(not np.array_equal(instruction_matrix(optimizer.mq_dict[key], self.num_qubits),
+                                          instruction_matrix(self.mq_dict[key], self.num_qubits))
+                       for key in self.mq_dict)):
+            raise Exception("Error: optimizer multi-qubit instructions do not match pool instructions")
+
+    def find_parameters_least_squares(self, optimizer: Optimizer, num_guesses: int, cost_threshold: float = None,
+                                      infidelity_threshold: float = None, time_budget: float = None,
+                                      max_evaluations: int = None, seed: int = None, chunksize: int = 1,
+                                      initial_guesses: List[np.ndarray] = None) -> Tuple[np.ndarray, float]:
+        """
+        Run trust region-based optimization num_guesses times for the structure of an Optimizer on the
+        pool's workers. Starts are handed out chunksize at a time as workers become free. Once a threshold
+        or budget ends the search, starts not yet begun are skipped and running starts are abandoned at
+        their next residual evaluation, so the workers are free for the next call. Semantics of the stopping
+        criteria and the seed match Optimizer.find_parameters_least_squares_par.
+
+        max_evaluations is enforced as in Optimizer.find_parameters_least_squares: every start is capped
+        at the whole budget, and a start that used at least the evaluations left when its turn comes is
+        run again in this process with the sequential cap, so a seeded run gives the same result with
+        or without the pool.
+
+        :param optimizer: Optimizer defining the structure, penalties and fixed parameters
+        :param num_guesses: integer
+        :param cost_threshold: stop once a start reaches a least-squares cost at most this value
+        :param infidelity_threshold: stop once a start reaches a unitary infidelity at most this value
+        :param time_budget: wall-clock seconds after which running starts are abandoned (at their next
+        residual evaluation)
+        :param max_evaluations: total number of residual evaluations over all starts
+        :param seed: seed of the random starting points (fresh entropy if None)
+        :param chunksize: number of starts handed to a worker at a time
+        :param initial_guesses: optional list of full parameter vectors tried before the random starts
+        :return: Numpy array of parameters that minimize least-squares objective function
+        """
+        self._check_compatible(optimizer)
+
+        min_fun_val = np.inf
+        min_params = None
+
+        if num_guesses == 0:
+            return min_params, min_fun_val
+
+        self._call_id += 1
+        non_fixed_params = np.asarray(optimizer.non_fixed_params, dtype=np.float64)
+        fixed_params_vals = np.asarray(optimizer.fixed_params_vals, dtype=np.float64)
+        tasks = [(self._call_id, tuple(optimizer.mq_instructions), optimizer.alpha, optimizer.gamma,
+                  non_fixed_params, fixed_params_vals,
+                  (optimizer.precision, optimizer.polish_threshold, optimizer.stats is not None), start,
+                  max_evaluations)
+                 for start in optimizer.start_points(num_guesses, seed, initial_guesses)]
+
+        start_time = time.perf_counter()
+        evaluations = 0
+        results = self._pool.imap(_run_start, tasks, chunksize)
+        for task in tasks:
+            timeout = None if time_budget is None else max(time_budget - (time.perf_counter() - start_time), 0)
+            try:
+                params, cost, nfev, record = results.next(timeout)
+            except multiprocessing.TimeoutError:
+                break
+            max_nfev = None if max_evaluations is None else max_evaluations - evaluations
+            if max_nfev is not None and nfev >= max_nfev:
+                # The sequential search would have stopped this start at the evaluations left
+                start = task[7]
+                x0 = optimizer.random_start(start) if isinstance(start, np.random.SeedSequence) else start
+                params, cost, nfev = optimizer.run_least_squares(x0, max_nfev)
+            elif record is not None:
+                optimizer.stats.records.append(record)
+
+            evaluations += nfev
+            if cost < min_fun_val:
+                min_fun_val = cost
+                min_params = params
+            if optimizer.reached_threshold(params, cost, cost_threshold, infidelity_threshold):
+                break
+            if max_evaluations is not None and evaluations >= max_evaluations:
+                break
+
+        with self._cancelled.get_lock():
+            self._cancelled.value = self._call_id  # workers skip or abandon the starts of this call
+
+        return min_params, min_fun_val
+
+
+def _call_indexed(call: Tuple[Callable, int, object]) -> Tuple[int, object]:
+    """
+    Applies a function to a task inside a worker process, keeping track of the task's position.
+
+    :param call: (function, task index, task)
+    :return: (task index, function(task))
+    """
+    function, index, task = call
+
+    return index, function(task)
+
+
+def is_coordinator() -> bool:
+    """
+    Tells whether this process gathers the results of distribute_tasks: rank 0 under MPI, or the only
+    process when MPI is not used.
+
+    :return: True on the coordinating process
+    """
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        return True
+
+    return MPI.COMM_WORLD.Get_rank() == 0
+
+
+def broadcast(value: object) -> object:
+    """
+    Shares a value computed on the coordinating process with every MPI rank (e.g. whether a search
+    continues), so all ranks take part in the same calls to distribute_tasks. Without MPI the value
+    is returned unchanged.
+
+    :param value: picklable value, only used on the coordinator
+    :return: the coordinator's value
+    """
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        return value
+
+    return MPI.COMM_WORLD.bcast(value, root=0)
+
+
+def distribute_tasks(function: Callable, tasks: Sequence, procs: int = None,
+                     callback: Callable = None) -> Optional[List[Tuple[object, object]]]:
+    """
+    Applies function to every task with dynamic load balancing. When the program runs under MPI with
+    more than one rank (and mpi4py is installed), rank 0 becomes a coordinator that hands out one task
+    at a time to whichever rank asks for work and gathers all results; any number of ranks covers the
+    whole task sequence. Otherwise the tasks are spread over procs local processes (run in-process if
+    procs is 1).
+
+    :param function: picklable function of one task (e.g. a module-level function)
+    :param tasks: sequence of picklable tasks; under MPI only rank 0's tasks are used and the other
+    ranks may pass None (see is_coordinator)
+    :param procs: number of local processes when MPI is not used (default: number of CPUs)
+    :param callback: optional function called with (task, result) on rank 0 as each result arrives
+    :return: list of (task, result) pairs in task order on rank 0 or locally, None on the other MPI ranks
+    """
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        MPI = None
+
+    if MPI is not None and MPI.COMM_WORLD.Get_size() > 1:
+        return _distribute_tasks_mpi(function, tasks, MPI, callback)
+
+    results = [None] * len(tasks)
+    if procs == 1:
+        calls = map(_call_indexed, ((function, index, task) for index, task in enumerate(tasks)))
+        for index, result in calls:
+            results[index] = (tasks[index], result)
+            if callback is not None:
+                callback(tasks[index], result)
+        return results
+
+    with multiprocessing.Pool(procs) as proc_pool:
+        calls = proc_pool.imap_unordered(_call_indexed, ((function, index, task) for index, task in enumerate(tasks)))
+        for index, result in calls:
+            results[index] = (tasks[index], result)
+            if callback is not None:
+                callback(tasks[index], result)
+
+    return results
+
+
+def _distribute_tasks_mpi(function: Callable, tasks: Sequence, MPI, callback: Callable) -> Optional[List[Tuple[object, object]]]:
+    """
+    Coordinator/worker implementation of distribute_tasks over MPI.COMM_WORLD.
+
+    :param function: function of one task
+    :param tasks: sequence of tasks (only used on rank 0)
+    :param MPI: the mpi4py.MPI module
+    :param callback: optional function called with (task, result) on rank 0
+    :return: list of (task, result) pairs on rank 0, None on the other ranks
+    """
+    comm = MPI.COMM_WORLD
+
+    if comm.Get_rank() != 0:
+        message = None  # the first message only asks for work
+        while True:
+            comm.send(message, dest=0, tag=_RESULT_TAG)
+            assignment = comm.recv(source=0, tag=_TASK_TAG)
+            if assignment is None:
+                return None
+            index, task = assignment
+            message = (index, function(task))
+
+    results = [None] * len(tasks)
+    status = MPI.Status()
+    next_index = 0
+    active_workers = comm.Get_size() - 1
+    while active_workers > 0:
+        message = comm.recv(source=MPI.ANY_SOURCE, tag=_RESULT_TAG, status=status)
+        if message is not None:
+            index, result = message
+            results[index] = (tasks[index], result)
+            if callback is not None:
+                callback(tasks[index], result)
+
+        if next_index < len(tasks):
+            comm.send((next_index, tasks[next_index]), dest=status.Get_source(), tag=_TASK_TAG)
+            next_index += 1
+        else:
+            comm.send(None, dest=status.Get_source(), tag=_TASK_TAG)
+            active_workers -= 1
+
+    return results
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains a cheap pre-screen that rejects circuit structures which provably cannot
+implement the target, before any numerical optimization is spent on them.
+
+The screen is based on the operator Schmidt rank across bipartitions of the qubits. U3 layers do not
+change the rank across any cut and the rank of a product is at most the product of the ranks, so a
+structure can only implement the target if, for every cut, the ranks of its instructions across
+that cut multiply to at least the rank of the target. In particular every qubit the target entangles
+must be connected to the rest through the instructions of the structure.
+"""
+from itertools import combinations
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from .unitary import instruction_matrix
+
+
+def operator_schmidt_rank(matrix: np.ndarray, num_qubits: int, subsystem: Sequence[int], tol: float = 1e-9) -> int:
+    """
+    Computes the operator Schmidt rank of an operator across the cut between subsystem and the other qubits.
+
+    :param matrix: 2^num_qubits x 2^num_qubits complex matrix
+    :param num_qubits: number of qubits the matrix acts on
+    :param subsystem: qubits on one side of the cut
+    :param tol: relative tolerance below which Schmidt coefficients count as zero
+    :return: number of nonzero Schmidt coefficients
+    """
+    subsystem = list(subsystem)
+    rest = [qubit for qubit in range(num_qubits) if qubit not in subsystem]
+    tensor = np.reshape(matrix, (2,) * (2 * num_qubits))
+    axes = subsystem + [num_qubits + qubit for qubit in subsystem] + rest + [num_qubits + qubit for qubit in rest]
+    cut = tensor.transpose(axes).reshape(4 ** len(subsystem), 4 ** len(rest))
+    singular_values = np.linalg.svd(cut, compute_uv=False)
+
+    return int(np.count_nonzero(singular_values > tol * singular_values[0]))
+
+
+class StructurePrescreen:
+    def __init__(self, num_qubits: int, mq_dict: Dict[int, np.ndarray], target: np.ndarray, tol: float = 1e-9):
+        """
+        Constructor for StructurePrescreen class. Computes the Schmidt ranks of the target and of every
+        instruction across every cut once.
+
+        :param num_qubits: number of qubits used by target operation
+        :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+        :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+        :param tol: relative tolerance below which Schmidt coefficients count as zero
+        """
+        self.num_qubits = num_qubits
+        self.mq_dict = mq_dict
+        self.target = target
+
+        # Every bipartition once: the side containing qubit 0
+        self.cuts = [(0, ) + others for size in range(num_qubits - 1)
+                     for others in combinations(range(1, num_qubits), size)]
+        self.target_ranks = np.array([operator_schmidt_rank(target, num_qubits, cut, tol) for cut in self.cuts])
+        matrices = {key: instruction_matrix(instruction, num_qubits) for key, instruction in mq_dict.items()}
+        self.gate_ranks = {key: np.array([operator_schmidt_rank(matrix, num_qubits, cut, tol) for cut in self.cuts])
+                           for key, matrix in matrices.items()}
+
+    def rank_bounds(self, structure: Sequence[int]) -> np.ndarray:
+        """
+        Upper bounds on the Schmidt rank of any unitary the structure implements, one per cut.
+
+        :param structure: sequence of multi-qubit instruction indices
+        :return: Numpy array of bounds aligned with self.cuts
+        """
+        bounds = np.ones(len(self.cuts), dtype=np.int64)
+        for ins in structure:
+            bounds = np.minimum(bounds * self.gate_ranks[ins], 4 ** self.num_qubits)  # no rank exceeds 4^n
+
+        return bounds
+
+    def is_feasible(self, structure: Sequence[int]) -> bool:
+        """
+        Checks the necessary condition: for every cut the instructions of the structure can build up at
+        least the Schmidt rank of the target. A False answer is a proof of infeasibility; a True answer
+        only means the structure is worth optimizing.
+
+        :param structure: sequence of multi-qubit instruction indices
+        :return: True if the structure passes the screen
+        """
+        return bool(np.all(self.rank_bounds(structure) >= self.target_ranks))
+
+    def filter(self, structures: Sequence[Sequence[int]]) -> Tuple[List[Tuple[int, ...]], List[Tuple[int, ...]]]:
+        """
+        Splits structures into those that pass the screen and those that are rejected.
+
+        :param structures: iterable of structures
+        :return: tuple of the list of feasible structures and the list of rejected structures
+        """
+        feasible = []
+        rejected = []
+        for structure in structures:
+            (feasible if self.is_feasible(structure) else rejected).append(tuple(structure))
+
+        return feasible, rejected
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains search strategies over circuit structures that share work between structures
+instead of optimizing each one in isolation.
+
+Structures form a graph in which two structures are neighbours when they differ by one edit: a
+substituted instruction, or an instruction inserted or deleted together with one U3 layer. Solutions
+of neighbours are often close to solutions of the structure itself, so they make good starting
+points for the least-squares multistart (WarmStartSearch). Most starts of most structures are
+hopeless, so racing them on small evaluation budgets and only continuing the best ones spends the
+compute where it matters (SuccessiveHalving).
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+import time
+import numpy as np
+from .optimizer import Optimizer
+from .parallel import broadcast, distribute_tasks, is_coordinator
+from .prescreen import StructurePrescreen
+from .stats import OptimizerStats
+from .store import ResultsStore
+from .structures import iter_circuit_structures, rank_structure
+from .symmetry import StructureCanonicalizer
+from .unitary import UnitaryBuilder
+from .utils import get_unitary_infidelity
+
+
+def layer_masks(num_qubits: int, num_layers: int, fixed_layers: Sequence[int] = ()) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parameter masks for structures with num_layers multi-qubit instructions in which some U3 layers
+    are fixed to the identity.
+
+    :param num_qubits: number of qubits used by target operation
+    :param num_layers: number of multi-qubit instructions
+    :param fixed_layers: indices of the fixed U3 layers (negative indices count from the last layer)
+    :return: tuple of the 0/1 Numpy array marking free parameters and the Numpy array of fixed values
+    """
+    layer_size = 3 * num_qubits
+    non_fixed_params = np.ones(layer_size * (num_layers + 1))
+    for layer in fixed_layers:
+        layer %= num_layers + 1
+        non_fixed_params[layer * layer_size:(layer + 1) * layer_size] = 0
+
+    return non_fixed_params, np.zeros(len(non_fixed_params))
+
+
+def record_class(store: ResultsStore, canonicalizer: StructureCanonicalizer, structure: Sequence[int],
+                 params: np.ndarray, cost: float, infidelity: float, num_starts: int, seconds: float) -> None:
+    """
+    Records the result of an optimized representative, and the results the other members of its
+    symmetry class inherit from it.
+
+    :param store: ResultsStore to write to
+    :param canonicalizer: StructureCanonicalizer defining the symmetry classes
+    :param structure: sequence of multi-qubit instruction indices
+    :param params: Numpy array of best parameters found (None if no start completed)
+    :param cost: least-squares cost of params
+    :param infidelity: unitary infidelity of params with respect to the target
+    :param num_starts: number of optimization starts spent on the structure
+    :param seconds: wall-clock time spent on the structure
+    """
+    store.record(structure, params, cost, infidelity, num_starts, seconds)
+    if params is None:
+        return
+    for member, symmetry in canonicalizer.orbit(structure):
+        if tuple(member) != tuple(structure):
+            store.record(member, canonicalizer.transform_params(params, symmetry), cost, infidelity, 0, 0,
+                         representative=structure)
+
+
+class WarmStartSearch:
+    def __init__(self, num_qubits: int, mq_dict: Dict[int, np.ndarray], target: np.ndarray, alpha: float = 0,
+                 gamma: float = 0, max_neighbors: int = 4, precision: str = 'double'):
+        """
+        Constructor for WarmStartSearch class.
+
+        :param num_qubits: number of qubits used by target operation
+        :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+        :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+        :param alpha: weight of the penalty for non-standard angles
+        :param gamma: weight of the penalty for large angles
+        :param max_neighbors: maximum number of starts seeded from neighbours, the rest being random
+        :param precision: 'double' or 'mixed' (see Optimizer)
+        """
+        self.num_qubits = num_qubits
+        self.mq_dict = mq_dict
+        self.target = target
+        self.alpha = alpha
+        self.gamma = gamma
+        self.max_neighbors = max_neighbors
+        self.precision = precision
+        self.solved = {}  # structure -> (parameters, cost) of the best result seen so far
+
+    def add_solution(self, structure: Sequence[int], params: np.ndarray, cost: float) -> None:
+        """
+        Remembers the result of a structure, keeping the better one if the structure is already known.
+
+        :param structure: sequence of multi-qubit instruction indices
+        :param params: Numpy array of parameters completing quantum circuit specification (ignored if None)
+        :param cost: least-squares cost of params
+        """
+        if params is None:
+            return
+        structure = tuple(structure)
+        if structure not in self.solved or cost < self.solved[structure][1]:
+            self.solved[structure] = (np.asarray(params, dtype=np.float64), cost)
+
+    def add_results(self, results: Dict[str, object]) -> None:
+        """
+        Remembers the results of a sweep, e.g. loaded with pyquopt.ResultsStore.load.
+
+        :param results: dictionary with 'structure', 'params' and 'cost' columns
+        """
+        for structure, params, cost in zip(results['structure'], results['params'], results['cost']):
+            self.add_solution(structure, params, cost)
+
+    def neighbor_guesses(self, structure: Sequence[int]) -> List[Tuple[Tuple[int, ...], np.ndarray, float]]:
+        """
+        Translates the solutions of already solved neighbours into parameters for a structure.
+
+        * substitution: the neighbour's parameters are used unchanged,
+        * insertion (the neighbour lacks instruction k): an identity U3 layer is inserted after instruction k,
+        * deletion (the neighbour has an extra instruction k): the U3 layer after instruction k is dropped.
+
+        :param structure: sequence of multi-qubit instruction indices
+        :return: list of (neighbour, parameters for structure, neighbour cost), best neighbour first
+        """
+        structure = tuple(structure)
+        layer_size = 3 * self.num_qubits
+        guesses = []
+
+        for position, ins in enumerate(structure):
+            for other in self.mq_dict:
+                neighbor = structure[:position] + (other, ) + structure[position + 1:]
+                if other != ins and neighbor in self.solved:
+                    params, cost = self.solved[neighbor]
+                    guesses.append((neighbor, params, cost))
+
+            neighbor = structure[:position] + structure[position + 1:]
+            if neighbor in self.solved:
+                params, cost = self.solved[neighbor]
+                split = (position + 1) * layer_size
+                guesses.append((neighbor, np.concatenate((params[:split], np.zeros(layer_size), params[split:])), cost))
+
+        for position in range(len(structure) + 1):
+            for other in self.mq_dict:
+                neighbor = structure[:position] + (other, ) + structure[position:]
+                if neighbor in self.solved:
+                    params, cost = self.solved[neighbor]
+                    split = (position + 1) * layer_size
+                    guesses.append((neighbor, np.concatenate((params[:split], params[split + layer_size:])), cost))
+
+        unique = {}
+        for neighbor, params, cost in guesses:
+            unique.setdefault(neighbor, (neighbor, params, cost))
+
+        return sorted(unique.values(), key=lambda guess: guess[2])
+
+    def optimize(self, structure: Sequence[int], non_fixed_params: np.ndarray, fixed_params_vals: np.ndarray,
+                 num_guesses: int, cost_threshold: float = None, infidelity_threshold: float = None,
+                 time_budget: float = None, max_evaluations: int = None, seed: int = None,
+                 stats: OptimizerStats = None) -> Tuple[np.ndarray, float]:
+        """
+        Optimizes a structure with up to max_neighbors starts seeded from its best solved neighbours
+        followed by random starts, then remembers the result for the structures optimized after it.
+        The stopping criteria and seed are those of Optimizer.find_parameters_least_squares.
+
+        :param structure: sequence of multi-qubit instruction indices
+        :param non_fixed_params: 0/1 Numpy array marking the parameters the optimizer may change
+        :param fixed_params_vals: Numpy array of values taken by the fixed parameters
+        :param num_guesses: total number of starts
+        :param cost_threshold: stop once a start reaches a least-squares cost at most this value
+        :param infidelity_threshold: stop once a start reaches a unitary infidelity at most this value
+        :param time_budget: wall-clock seconds after which the running start is abandoned (at its next
+        residual evaluation)
+        :param max_evaluations: total number of residual evaluations over all starts
+        :param seed: seed (or SeedSequence) of the random starting points (fresh entropy if None)
+        :param stats: optional OptimizerStats recording the starts that were run
+        :return: Numpy array of parameters that minimize least-squares objective function and its cost
+        """
+        optimizer = Optimizer(self.num_qubits, list(structure), self.mq_dict, self.target, self.alpha, self.gamma,
+                              non_fixed_params, fixed_params_vals, precision=self.precision, stats=stats)
+        initial_guesses = [params for _, params, _ in self.neighbor_guesses(structure)[:self.max_neighbors]]
+
+        params, cost = optimizer.find_parameters_least_squares(num_guesses, cost_threshold, infidelity_threshold,
+                                                               time_budget, max_evaluations, seed,
+                                                               initial_guesses=initial_guesses)
+        self.add_solution(structure, params, cost)
+
+        return params, cost
+
+
+class SuccessiveHalving:
+    def __init__(self, num_qubits: int, mq_dict: Dict[int, np.ndarray], target: np.ndarray, alpha: float = 0,
+                 gamma: float = 0, min_evaluations: int = 16, max_evaluations: int = 1024, keep_fraction: float = 0.5):
+        """
+        Constructor for SuccessiveHalving class, a racing scheduler for least-squares starts over many
+        structures at once. Every (structure, start) pair is run for a small number of residual
+        evaluations; the best keep_fraction of the pairs by cost survive and continue from where they
+        stopped with twice the budget, until the budget reaches max_evaluations and the survivors are
+        run to convergence.
+
+        :param num_qubits: number of qubits used by target operation
+        :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+        :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+        :param alpha: weight of the penalty for non-standard angles
+        :param gamma: weight of the penalty for large angles
+        :param min_evaluations: residual evaluations per start in the first round
+        :param max_evaluations: budget at which the surviving starts are run to convergence
+        :param keep_fraction: fraction of the starts kept after each round
+        """
+        if not 0 < keep_fraction < 1:
+            raise Exception("Error: keep_fraction must lie strictly between 0 and 1")
+
+        self.num_qubits = num_qubits
+        self.mq_dict = mq_dict
+        self.target = target
+        self.alpha = alpha
+        self.gamma = gamma
+        self.min_evaluations = min_evaluations
+        self.max_evaluations = max_evaluations
+        self.keep_fraction = keep_fraction
+
+    def race(self, structures: Sequence[Sequence[int]], non_fixed_params: np.ndarray, fixed_params_vals: np.ndarray,
+             num_guesses: int, cost_threshold: float = None, infidelity_threshold: float = None, seed: int = None,
+             initial_guesses: Dict[Tuple[int, ...], List[np.ndarray]] = None) -> Dict[Tuple[int, ...], Tuple[np.ndarray, float]]:
+        """
+        Races num_guesses starts of every structure. A structure is solved, and its remaining starts
+        leave the race, as soon as one of its starts meets cost_threshold or infidelity_threshold. A
+        start that converges before using its budget has reached a local minimum and also leaves the race.
+        Start i of structure j draws its initial point from the i-th child of the j-th child of
+        SeedSequence(seed), so a seeded race is reproducible.
+
+        :param structures: sequence of structures with the same number of layers
+        :param non_fixed_params: 0/1 Numpy array marking the parameters the optimizer may change
+        :param fixed_params_vals: Numpy array of values taken by the fixed parameters
+        :param num_guesses: number of starts per structure
+        :param cost_threshold: a start reaching a least-squares cost at most this value solves its structure
+        :param infidelity_threshold: a start reaching a unitary infidelity at most this value solves its structure
+        :param seed: seed of the random starting points (fresh entropy if None)
+        :param initial_guesses: optional dictionary mapping structures to full parameter vectors that replace
+        their first random starts (see WarmStartSearch.neighbor_guesses)
+        :return: dictionary mapping every structure to its best parameters and their least-squares cost
+        """
+        structures = [tuple(structure) for structure in structures]
+        initial_guesses = {} if initial_guesses is None else initial_guesses
+        optimizers = {}
+        arms = []  # [structure, free parameters, cost]
+        for structure, seed_sequence in zip(structures, np.random.SeedSequence(seed).spawn(len(structures))):
+            optimizer = Optimizer(self.num_qubits, list(structure), self.mq_dict, self.target, self.alpha, self.gamma,
+                                  non_fixed_params, fixed_params_vals)
+            optimizers[structure] = optimizer
+            for start in optimizer.start_points(num_guesses, seed_sequence, initial_guesses.get(structure)):
+                x0 = optimizer.random_start(start) if isinstance(start, np.random.SeedSequence) else start
+                arms.append([structure, x0, np.inf])
+
+        best = {structure: (None, np.inf) for structure in structures}
+        budget = self.min_evaluations
+        while arms:
+            final_round = budget >= self.max_evaluations
+            survivors = []
+            for arm in arms:
+                structure, x0, _ = arm
+                if structure not in optimizers:
+                    continue  # solved by another start in this round
+                optimizer = optimizers[structure]
+                params, cost, nfev = optimizer.run_least_squares(x0, None if final_round else budget)
+                if cost < best[structure][1]:
+                    best[structure] = (params, cost)
+                if optimizer.reached_threshold(params, cost, cost_threshold, infidelity_threshold):
+                    del optimizers[structure]
+                elif not final_round and nfev >= budget:
+                    arm[1] = optimizer.pack_params(params)
+                    arm[2] = cost
+                    survivors.append(arm)
+
+            survivors = [arm for arm in survivors if arm[0] in optimizers]
+            survivors.sort(key=lambda arm: arm[2])
+            arms = survivors[:int(np.ceil(self.keep_fraction * len(survivors)))]
+            budget *= 2
+
+        return best
+
+
+def optimize_candidate(task: tuple) -> Tuple[np.ndarray, float, float, int, float]:
+    """
+    Runs WarmStartSearch.optimize on one structure of a DepthIterativeSearch, in whichever process
+    distribute_tasks picks.
+
+    :param task: (num_qubits, mq_dict, target, alpha, gamma, max_neighbors, precision, neighbours, structure,
+    non_fixed_params, fixed_params_vals, num_guesses, cost_threshold, infidelity_threshold, seed sequence),
+    where neighbours maps the solved neighbours of the structure to their parameters and cost
+    :return: tuple of the best parameters, their cost, their infidelity, the number of starts run and
+    the wall-clock time spent (the arguments of record_class after the structure)
+    """
+    (num_qubits, mq_dict, target, alpha, gamma, max_neighbors, precision, neighbors, structure, non_fixed_params,
+     fixed_params_vals, num_guesses, cost_threshold, infidelity_threshold, seed_sequence) = task
+    start_time = time.perf_counter()
+    warm_start = WarmStartSearch(num_qubits, mq_dict, target, alpha, gamma, max_neighbors, precision)
+    for neighbor, (params, cost) in neighbors.items():
+        warm_start.add_solution(neighbor, params, cost)
+    # The starts are counted, as the thresholds may end the multistart early
+    stats = OptimizerStats()
+    params, cost = warm_start.optimize(structure, non_fixed_params, fixed_params_vals, num_guesses, cost_threshold,
+                                       infidelity_threshold, seed=seed_sequence, stats=stats)
+    infidelity = np.inf
+    if params is not None:
+        implementation_matrix = UnitaryBuilder(num_qubits, list(structure), mq_dict).build_unitary(params)
+        infidelity = get_unitary_infidelity(target, implementation_matrix, 2 ** num_qubits)
+
+    return params, cost, infidelity, len(stats.records), time.perf_counter() - start_time
+
+
+class DepthIterativeSearch:
+    def __init__(self, num_qubits: int, mq_dict: Dict[int, np.ndarray], target: np.ndarray, alpha: float = 0,
+                 gamma: float = 0, fixed_layers: Sequence[int] = (), max_neighbors: int = 4,
+                 store: ResultsStore = None, precision: str = 'double'):
+        """
+        Constructor for DepthIterativeSearch class, which looks for the structures with the fewest
+        multi-qubit instructions that implement the target.
+
+        :param num_qubits: number of qubits used by target operation
+        :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+        :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+        :param alpha: weight of the penalty for non-standard angles
+        :param gamma: weight of the penalty for large angles
+        :param fixed_layers: indices of the U3 layers fixed to the identity at every depth (negative indices
+        count from the last layer, e.g. (0, -1) for the first and last layers)
+        :param max_neighbors: maximum number of starts per structure seeded from solved neighbours
+        :param store: optional ResultsStore recording every attempt; structures already in it are not optimized
+        again (under MPI, only the coordinator's store is used)
+        :param precision: 'double' or 'mixed' (see Optimizer)
+        """
+        self.num_qubits = num_qubits
+        self.mq_dict = mq_dict
+        self.target = target
+        self.fixed_layers = fixed_layers
+        self.store = store
+        self.prescreen = StructurePrescreen(num_qubits, mq_dict, target)
+        self.warm_start = WarmStartSearch(num_qubits, mq_dict, target, alpha, gamma, max_neighbors, precision)
+        if store is not None:
+            self.warm_start.add_results(store.load())
+
+    def layer_masks(self, num_layers: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Parameter masks for structures with num_layers multi-qubit instructions (see layer_masks).
+
+        :param num_layers: number of multi-qubit instructions
+        :return: tuple of the 0/1 Numpy array marking free parameters and the Numpy array of fixed values
+        """
+        return layer_masks(self.num_qubits, num_layers, self.fixed_layers)
+
+    def candidates(self, num_layers: int, canonicalizer: StructureCanonicalizer) -> List[Tuple[int, ...]]:
+        """
+        Lists the structures of one depth that are worth optimizing: those that pass the pre-screen, are
+        not reducible and represent their symmetry class. Structures with the best solved neighbours
+        come first, so a feasible structure tends to be found early.
+
+        :param num_layers: number of multi-qubit instructions
+        :param canonicalizer: StructureCanonicalizer for this depth's parameter masks
+        :return: list of structures
+        """
+        structures = [tuple(structure) for structure in iter_circuit_structures(len(self.mq_dict), num_layers)
+                      if self.prescreen.is_feasible(structure) and not canonicalizer.is_reducible(structure)
+                      and canonicalizer.is_canonical(structure)]
+        neighbor_costs = {}
+        for structure in structures:
+            guesses = self.warm_start.neighbor_guesses(structure)
+            neighbor_costs[structure] = guesses[0][2] if guesses else np.inf
+
+        return sorted(structures, key=lambda structure: neighbor_costs[structure])
+
+    def search(self, max_depth: int, min_depth: int = 1, num_guesses: int = 20, cost_threshold: float = None,
+               infidelity_threshold: float = 1e-8, finish_depth: bool = False, seed: int = None,
+               procs: int = 1) -> Tuple[Optional[int], Dict[Tuple[int, ...], Tuple[np.ndarray, float]]]:
+        """
+        Searches depths min_depth, min_depth + 1, ... up to max_depth and stops at the first depth at
+        which a structure meets cost_threshold or infidelity_threshold. Solutions and near misses of
+        shallower depths warm-start the deeper ones (see WarmStartSearch).
+
+        :param max_depth: largest number of multi-qubit instructions to try
+        :param min_depth: smallest number of multi-qubit instructions to try
+        :param num_guesses: number of least-squares starts per structure
+        :param cost_threshold: a structure is feasible once a start reaches a least-squares cost at most this value
+        :param infidelity_threshold: a structure is feasible once a start reaches a unitary infidelity at most this value
+        :param finish_depth: optimize every candidate of the minimal depth instead of stopping at the first solution
+        :param seed: seed of the random starting points (fresh entropy if None)
+        :param procs: number of processes optimizing the structures of a depth (see search_depth)
+        :return: tuple of the minimal depth (None if no depth up to max_depth is feasible) and a dictionary
+        mapping the feasible representative structures of that depth to their parameters and cost (empty on
+        MPI ranks other than the coordinator)
+        """
+        entropy = np.random.SeedSequence(seed).entropy
+        for num_layers in range(min_depth, max_depth + 1):
+            solutions = self.search_depth(num_layers, num_guesses, cost_threshold, infidelity_threshold, finish_depth,
+                                          entropy, procs)
+            # Under MPI only the coordinator sees the solutions, and every rank must stop at the same depth
+            if broadcast(bool(solutions)):
+                return num_layers, solutions
+
+        return None, {}
+
+    def search_depth(self, num_layers: int, num_guesses: int = 20, cost_threshold: float = None,
+                     infidelity_threshold: float = 1e-8, finish_depth: bool = False, seed: int = None,
+                     procs: int = 1) -> Dict[Tuple[int, ...], Tuple[np.ndarray, float]]:
+        """
+        Optimizes the candidates of one depth that are not yet in the store, recording every result in
+        the store and remembering it for warm starts.
+
+        With procs 1 the candidates are optimized one after the other in this process, each warm-started
+        from everything solved before it, and the depth stops at the first solution unless finish_depth
+        is set. Otherwise the candidates are spread with distribute_tasks over procs local processes, or
+        over the MPI ranks, which must all call this method; the candidates are then warm-started from the
+        solutions known when the depth begins, and the whole depth is optimized.
+
+        :param num_layers: number of multi-qubit instructions
+        :param num_guesses: number of least-squares starts per structure
+        :param cost_threshold: a structure is feasible once a start reaches a least-squares cost at most this value
+        :param infidelity_threshold: a structure is feasible once a start reaches a unitary infidelity at most this value
+        :param finish_depth: optimize every candidate instead of stopping at the first solution (procs 1 only)
+        :param seed: seed of the random starting points (fresh entropy if None); structure s draws from
+        SeedSequence(seed, spawn_key=(num_layers, rank of s)), whichever process optimizes it
+        :param procs: number of local processes (default: in this process; None for all CPUs)
+        :return: dictionary mapping the feasible representative structures to their parameters and cost
+        (empty on MPI ranks other than the coordinator)
+        """
+        non_fixed_params, fixed_params_vals = self.layer_masks(num_layers)
+        canonicalizer = StructureCanonicalizer(self.num_qubits, self.mq_dict, self.target, non_fixed_params,
+                                               fixed_params_vals)
+        entropy = np.random.SeedSequence(seed).entropy
+        completed = set() if self.store is None else self.store.completed()
+        candidates = self.candidates(num_layers, canonicalizer) if procs == 1 or is_coordinator() else []
+        solutions = {}
+
+        def task(structure):
+            # Only the neighbours whose solutions seed the starts travel with the structure
+            neighbors = {neighbor: self.warm_start.solved[neighbor] for neighbor, _, _ in
+                         self.warm_start.neighbor_guesses(structure)[:self.warm_start.max_neighbors]}
+            seed_sequence = np.random.SeedSequence(entropy, spawn_key=(num_layers, rank_structure(structure, len(self.mq_dict))))
+            return (self.num_qubits, self.mq_dict, self.target, self.warm_start.alpha, self.warm_start.gamma,
+                    self.warm_start.max_neighbors, self.warm_start.precision, neighbors, structure, non_fixed_params,
+                    fixed_params_vals, num_guesses, cost_threshold, infidelity_threshold, seed_sequence)
+
+        def add_result(structure, result):
+            params, cost = result[:2]
+            self.warm_start.add_solution(structure, params, cost)
+            if self.store is not None:
+                record_class(self.store, canonicalizer, structure, *result)
+            if self._is_solution(structure, params, cost, non_fixed_params, fixed_params_vals, cost_threshold,
+                                 infidelity_threshold):
+                solutions[structure] = (params, cost)
+
+        pending = []
+        for structure in candidates:
+            if structure not in completed:
+                pending.append(structure)
+                continue
+            params, cost = self.warm_start.solved.get(structure, (None, np.inf))
+            if self._is_solution(structure, params, cost, non_fixed_params, fixed_params_vals, cost_threshold,
+                                 infidelity_threshold):
+                solutions[structure] = (params, cost)
+
+        if procs == 1:
+            for structure in pending:
+                if solutions and not finish_depth:
+                    break
+                add_result(structure, optimize_candidate(task(structure)))
+        else:
+            tasks = [task(structure) for structure in pending]
+            distribute_tasks(optimize_candidate, tasks, procs, callback=lambda task, result: add_result(task[8], result))
+
+        return solutions
+
+    def _is_solution(self, structure: Tuple[int, ...], params: np.ndarray, cost: float, non_fixed_params: np.ndarray,
+                     fixed_params_vals: np.ndarray, cost_threshold: float, infidelity_threshold: float) -> bool:
+        """
+        Checks whether the result of a structure meets the thresholds (see Optimizer.reached_threshold).
+        """
+        optimizer = Optimizer(self.num_qubits, list(structure), self.mq_dict, self.target, 0, 0,
+                              non_fixed_params, fixed_params_vals)
+
+        return optimizer.reached_threshold(params, cost, cost_threshold, infidelity_threshold)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains tools for snapping optimized circuit parameters to a grid of angles (e.g. the
+5-degree multiples of round_params) while keeping the circuit close to the target.
+"""
+from typing import Sequence, Tuple
+import numpy as np
+from .optimizer import Optimizer
+from .utils import get_unitary_infidelities
+
+
+def snap_params(optimizer: Optimizer, params: np.ndarray, step: float = np.pi / 36, snap_indices: Sequence[int] = None,
+                max_rounds: int = 100, polish: bool = False) -> Tuple[np.ndarray, float]:
+    """
+    Snaps parameters to multiples of step in [0, 2 pi); the other parameters keep their values. Starting
+    from the nearest grid point, the neighbourhood in which any one snapped parameter moves one grid
+    step up or down is evaluated as a single batch of unitaries, and the best neighbour is taken as long
+    as it lowers the infidelity. Optionally the free parameters left off the grid are then re-optimized
+    with the snapped ones fixed; this needs snap_indices to leave out some free parameters.
+
+    :param optimizer: Optimizer of the structure the parameters belong to
+    :param params: Numpy array of parameters completing quantum circuit specification
+    :param step: grid spacing in radians (default 5 degrees)
+    :param snap_indices: indices of the parameters to snap (default: the free parameters of optimizer)
+    :param max_rounds: maximum number of neighbourhood moves
+    :param polish: re-optimize the free parameters not in snap_indices after snapping (an error if there
+    are none, e.g. with the default snap_indices)
+    :return: tuple of the snapped parameters and their unitary infidelity to the target
+    """
+    builder = optimizer.unitary_builder
+    snap_indices = optimizer.free_indices if snap_indices is None else np.asarray(snap_indices, dtype=np.int64)
+    remaining = np.setdiff1d(optimizer.free_indices, snap_indices)
+    if polish and len(remaining) == 0:
+        raise Exception("Error: polish needs free parameters outside snap_indices")
+
+    snapped = np.array(params, dtype=np.float64)
+    snapped[snap_indices] = np.mod(step * np.rint(snapped[snap_indices] / step), 2 * np.pi)
+    infidelity = get_unitary_infidelities(optimizer.target, builder.build_unitary(snapped), builder.dim)
+
+    # Row 2 i moves parameter snap_indices[i] one step up, row 2 i + 1 one step down
+    moves = np.zeros((2 * len(snap_indices), len(snapped)))
+    moves[2 * np.arange(len(snap_indices)), snap_indices] = step
+    moves[2 * np.arange(len(snap_indices)) + 1, snap_indices] = -step
+    for _ in range(max_rounds):
+        candidates = snapped + moves
+        candidates[:, snap_indices] = np.mod(candidates[:, snap_indices], 2 * np.pi)
+        infidelities = get_unitary_infidelities(optimizer.target, builder.build_unitaries(candidates), builder.dim)
+        best = np.argmin(infidelities)
+        if infidelities[best] >= infidelity:
+            break
+        snapped = candidates[best]
+        infidelity = infidelities[best]
+
+    if polish:
+        non_fixed_params = np.zeros(len(snapped))
+        non_fixed_params[remaining] = 1
+        fixed_params_vals = np.array(snapped)
+        fixed_params_vals[remaining] = 0
+        polisher = Optimizer(optimizer.num_qubits, optimizer.mq_instructions, optimizer.mq_dict, optimizer.target,
+                             optimizer.alpha, optimizer.gamma, non_fixed_params, fixed_params_vals)
+        polished, _, _ = polisher.run_least_squares(polisher.pack_params(snapped))
+        polished_infidelity = get_unitary_infidelities(optimizer.target, builder.build_unitary(polished), builder.dim)
+        if polished_infidelity < infidelity:
+            snapped, infidelity = polished, polished_infidelity
+
+    return snapped, float(infidelity)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains an opt-in statistics collector for Optimizer. Given to an Optimizer, it records
+one entry per least-squares start: unitary evaluations and the time spent in them, iterations, the
+termination reason of the solver and the quality of the result. Without a collector the optimizer
+only pays one check per start.
+"""
+from typing import Callable, Dict
+import json
+import time
+import numpy as np
+from .utils import get_unitary_infidelity
+
+_EVALUATION_KEYS = ('residual_evaluations', 'residual_seconds', 'jacobian_evaluations', 'jacobian_seconds')
+
+
+def new_counters() -> Dict[str, float]:
+    """
+    :return: zeroed evaluation counters of one start
+    """
+    return dict.fromkeys(_EVALUATION_KEYS, 0)
+
+
+def timed(function: Callable, name: str, counters: Dict[str, float]) -> Callable:
+    """
+    Wraps a residual or Jacobian function so that its calls are counted and timed.
+
+    :param function: function to wrap
+    :param name: 'residual' or 'jacobian'
+    :param counters: dictionary of evaluation counters (see new_counters), updated in place
+    :return: wrapped function
+    """
+    def wrapper(*args):
+        start_time = time.perf_counter()
+        result = function(*args)
+        counters[name + '_seconds'] += time.perf_counter() - start_time
+        counters[name + '_evaluations'] += 1
+        return result
+
+    return wrapper
+
+
+class OptimizerStats:
+    def __init__(self):
+        """
+        Constructor for OptimizerStats class. The same collector may be shared by the optimizers of
+        many structures to gather the statistics of a whole sweep.
+        """
+        self.records = []
+
+    def clear(self) -> None:
+        """
+        Drops all records.
+        """
+        self.records = []
+
+    def add_start(self, optimizer: 'Optimizer', params: np.ndarray, cost: float, termination: Dict[str, object],
+                  seconds: float, counters: Dict[str, float]) -> Dict[str, object]:
+        """
+        Records one least-squares start.
+
+        :param optimizer: Optimizer that ran the start
+        :param params: Numpy array of optimized parameters
+        :param cost: least-squares cost reached
+        :param termination: solver status, message, iterations and whether a mixed-precision start was refined
+        :param seconds: wall-clock time of the start
+        :param counters: evaluation counters of the start (see new_counters)
+        :return: the record
+        """
+        infidelity = get_unitary_infidelity(optimizer.target, optimizer.unitary_builder.build_unitary(params),
+                                            optimizer.unitary_builder.dim)
+        record = {
+            'structure': [int(ins) for ins in optimizer.mq_instructions],
+            'precision': optimizer.precision,
+            'cost': float(cost),
+            'infidelity': float(infidelity),
+            'seconds': seconds,
+        }
+        record.update(counters)
+        record.update(termination)
+        self.records.append(record)
+
+        return record
+
+    def summary(self, infidelity_threshold: float = 1e-8) -> Dict[str, object]:
+        """
+        Aggregates the records.
+
+        :param infidelity_threshold: infidelity at which a start counts as a success
+        :return: dictionary of totals, means, the success rate and the count of every termination message
+        """
+        num_starts = len(self.records)
+        totals = {key: sum(record[key] for record in self.records) for key in _EVALUATION_KEYS}
+        seconds = sum(record['seconds'] for record in self.records)
+        successes = sum(record['infidelity'] <= infidelity_threshold for record in self.records)
+        terminations = {}
+        for record in self.records:
+            terminations[record['message']] = terminations.get(record['message'], 0) + 1
+
+        return {
+            'starts': num_starts,
+            'seconds': seconds,
+            **totals,
+            'iterations': sum(record['iterations'] for record in self.records),
+            'seconds_per_residual': totals['residual_seconds'] / max(totals['residual_evaluations'], 1),
+            'seconds_per_jacobian': totals['jacobian_seconds'] / max(totals['jacobian_evaluations'], 1),
+            'infidelity_threshold': infidelity_threshold,
+            'successes': successes,
+            'success_rate': successes / num_starts if num_starts else 0.0,
+            'terminations': terminations,
+        }
+
+    def to_json(self, infidelity_threshold: float = 1e-8) -> str:
+        """
+        :param infidelity_threshold: infidelity at which a start counts as a success
+        :return: JSON text with the summary and the list of records
+        """
+        return json.dumps({'summary': self.summary(infidelity_threshold), 'starts': self.records}, indent=1)
+
+    def dump(self, path: str, infidelity_threshold: float = 1e-8) -> None:
+        """
+        Writes to_json to a file.
+
+        :param path: file name
+        :param infidelity_threshold: infidelity at which a start counts as a success
+        """
+        with open(path, 'w') as stats_file:
+            stats_file.write(self.to_json(infidelity_threshold))
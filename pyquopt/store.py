@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains an append-only results store for circuit structure searches, backed by SQLite.
+Every attempted structure is recorded as soon as its optimization finishes, so an interrupted search
+can be resumed by skipping the structures already in the store.
+"""
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+import sqlite3
+import time
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    structure TEXT NOT NULL,
+    num_layers INTEGER NOT NULL,
+    params BLOB,
+    cost REAL,
+    infidelity REAL,
+    num_starts INTEGER,
+    seconds REAL,
+    representative TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_structure ON results (structure);
+"""
+
+
+def _encode_structure(structure: Sequence[int]) -> str:
+    return ','.join(str(int(ins)) for ins in structure)
+
+
+def _decode_structure(text: str) -> Tuple[int, ...]:
+    return tuple(int(ins) for ins in text.split(',')) if text else ()
+
+
+class ResultsStore:
+    def __init__(self, path: str):
+        """
+        Constructor for ResultsStore class. Opens (or creates) the SQLite database at path.
+
+        :param path: file name of the database
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+        """
+        self._connection.close()
+
+    def record(self, structure: Sequence[int], params: np.ndarray, cost: float, infidelity: float,
+               num_starts: int, seconds: float, representative: Sequence[int] = None) -> None:
+        """
+        Appends the result of one structure and commits it immediately.
+
+        :param structure: sequence of multi-qubit instruction indices
+        :param params: Numpy array of best parameters found (None if no start completed)
+        :param cost: least-squares cost of params
+        :param infidelity: unitary infidelity of params with respect to the target
+        :param num_starts: number of optimization starts spent on the structure
+        :param seconds: wall-clock time spent on the structure
+        :param representative: structure whose optimized result this one inherits through a symmetry, if any
+        """
+        blob = None if params is None else np.asarray(params, dtype=np.float64).tobytes()
+        self._connection.execute(
+            "INSERT INTO results (structure, num_layers, params, cost, infidelity, num_starts, seconds, "
+            "representative, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (_encode_structure(structure), len(structure), blob, float(cost), float(infidelity), int(num_starts),
+             float(seconds), None if representative is None else _encode_structure(representative), time.time()))
+        self._connection.commit()
+
+    def completed(self) -> Set[Tuple[int, ...]]:
+        """
+        Lists the structures that already have a result.
+
+        :return: set of structures as tuples of instruction indices
+        """
+        rows = self._connection.execute("SELECT DISTINCT structure FROM results")
+
+        return {_decode_structure(text) for (text, ) in rows}
+
+    def pending(self, structures: Iterable[Sequence[int]]) -> List[Tuple[int, ...]]:
+        """
+        Filters out the structures that already have a result, for resuming a search.
+
+        :param structures: iterable of structures
+        :return: list of structures (as tuples) without a result
+        """
+        completed = self.completed()
+
+        return [tuple(structure) for structure in structures if tuple(structure) not in completed]
+
+    def load(self, num_layers: int = None, max_infidelity: float = None) -> Dict[str, object]:
+        """
+        Loads results in columnar form for analysis. When a structure was recorded more than once,
+        every record is returned.
+
+        :param num_layers: only load structures with this many layers (default: all)
+        :param max_infidelity: only load results with at most this infidelity (default: all)
+        :return: dictionary with 'structure' and 'representative' (lists of tuples, representative None for
+        directly optimized structures), 'params' (list of Numpy arrays) and 'cost', 'infidelity',
+        'num_starts', 'seconds' (Numpy arrays)
+        """
+        query = "SELECT structure, params, cost, infidelity, num_starts, seconds, representative FROM results"
+        conditions, arguments = [], []
+        if num_layers is not None:
+            conditions.append("num_layers = ?")
+            arguments.append(num_layers)
+        if max_infidelity is not None:
+            conditions.append("infidelity <= ?")
+            arguments.append(max_infidelity)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self._connection.execute(query + " ORDER BY id", arguments).fetchall()
+
+        return {
+            'structure': [_decode_structure(row[0]) for row in rows],
+            'params': [None if row[1] is None else np.frombuffer(row[1], dtype=np.float64) for row in rows],
+            'cost': np.array([row[2] for row in rows], dtype=np.float64),
+            'infidelity': np.array([row[3] for row in rows], dtype=np.float64),
+            'num_starts': np.array([row[4] for row in rows], dtype=np.int64),
+            'seconds': np.array([row[5] for row in rows], dtype=np.float64),
+            'representative': [None if row[6] is None else _decode_structure(row[6]) for row in rows],
+        }
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains tools for enumerating the circuit structures (sequences of multi-qubit
+instructions) over which parameterized circuits are optimized.
+
+Structures over num_mq_ins instructions with num_layers layers are numbered 0 to
+num_mq_ins^num_layers - 1, with the first layer as the least significant base-num_mq_ins digit.
+This is the order in which generate_circuit_structures in applications/context lists them.
+"""
+from typing import Iterator, List, Sequence
+
+
+def count_circuit_structures(num_mq_ins: int, num_layers: int) -> int:
+    """
+    Number of circuit structures with num_layers layers over num_mq_ins instructions.
+
+    :param num_mq_ins: number of multi-qubit instructions
+    :param num_layers: number of circuit layers
+    :return: num_mq_ins ** num_layers
+    """
+    return num_mq_ins ** num_layers
+
+
+def unrank_structure(index: int, num_mq_ins: int, num_layers: int) -> List[int]:
+    """
+    Computes the circuit structure with a given index in O(num_layers).
+
+    :param index: integer in [0, num_mq_ins ** num_layers)
+    :param num_mq_ins: number of multi-qubit instructions
+    :param num_layers: number of circuit layers
+    :return: a list of num_layers instruction indices
+    """
+    if not 0 <= index < count_circuit_structures(num_mq_ins, num_layers):
+        raise Exception("Error: invalid structure index")
+
+    structure = []
+    for _ in range(num_layers):
+        index, ins = divmod(index, num_mq_ins)
+        structure.append(ins)
+
+    return structure
+
+
+def rank_structure(structure: Sequence[int], num_mq_ins: int) -> int:
+    """
+    Computes the index of a circuit structure (inverse of unrank_structure) in O(len(structure)).
+
+    :param structure: a sequence of instruction indices
+    :param num_mq_ins: number of multi-qubit instructions
+    :return: integer index of the structure
+    """
+    index = 0
+    for ins in reversed(structure):
+        if not 0 <= ins < num_mq_ins:
+            raise Exception("Error: invalid instruction in structure")
+        index = index * num_mq_ins + ins
+
+    return index
+
+
+def iter_circuit_structures(num_mq_ins: int, num_layers: int, start: int = 0, stop: int = None,
+                            step: int = 1) -> Iterator[List[int]]:
+    """
+    Lazily generates the circuit structures with indices in range(start, stop, step), using constant
+    memory regardless of how many structures there are.
+
+    :param num_mq_ins: number of multi-qubit instructions
+    :param num_layers: number of circuit layers
+    :param start: index of the first structure
+    :param stop: index past the last structure (default: all structures)
+    :param step: stride between generated indices (e.g. the number of workers sharing a sweep)
+    :return: an iterator over lists of num_layers instruction indices
+    """
+    count = count_circuit_structures(num_mq_ins, num_layers)
+    stop = count if stop is None else min(stop, count)
+
+    for index in range(start, stop, step):
+        yield unrank_structure(index, num_mq_ins, num_layers)
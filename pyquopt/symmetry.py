@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains tools for pruning circuit structure sweeps: structures related by a symmetry of
+the target and gate set are grouped into equivalence classes so that only one representative per
+class has to be optimized, and structures whose gates cancel are recognized as reducible.
+
+A symmetry is a composition of three commuting operations on circuits, each of which must map the
+target to itself and the gate set to itself:
+
+* a relabeling of qubits, U -> P U P^dagger,
+* complex conjugation, U -> U*,
+* reversal, U -> U^dagger, which reverses the order of the multi-qubit instructions.
+
+Each maps U3 gates to U3 gates, so a structure is feasible if and only if its image is, and optimal
+parameters carry over through transform_params.
+"""
+from itertools import permutations
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from .structures import rank_structure
+from .unitary import UnitaryBuilder, instruction_matrix
+
+Symmetry = Tuple[Tuple[int, ...], bool, bool]  # (qubit permutation, conjugate, reverse)
+
+
+def permute_qubits(matrix: np.ndarray, perm: Sequence[int]) -> np.ndarray:
+    """
+    Relabels the qubits of an operator, moving qubit j to qubit perm[j].
+
+    :param matrix: 2^n x 2^n complex matrix
+    :param perm: permutation of range(n)
+    :return: P matrix P^dagger for the qubit permutation P
+    """
+    num_qubits = len(perm)
+    inverse = np.argsort(perm)
+    axes = list(inverse) + [num_qubits + axis for axis in inverse]
+    tensor = np.reshape(matrix, (2,) * (2 * num_qubits)).transpose(axes)
+
+    return tensor.reshape(2 ** num_qubits, 2 ** num_qubits)
+
+
+def is_local(matrix: np.ndarray, num_qubits: int, tol: float = 1e-9) -> bool:
+    """
+    Checks whether an operator is a tensor product of single-qubit operators, i.e. whether its operator
+    Schmidt rank across every single-qubit cut is one.
+
+    :param matrix: 2^num_qubits x 2^num_qubits complex matrix
+    :param num_qubits: number of qubits the matrix acts on
+    :param tol: relative tolerance on the second Schmidt coefficient
+    :return: True if the matrix is local
+    """
+    tensor = np.reshape(matrix, (2,) * (2 * num_qubits))
+    for qubit in range(num_qubits):
+        cut = np.moveaxis(tensor, (qubit, num_qubits + qubit), (0, 1)).reshape(4, -1)
+        singular_values = np.linalg.svd(cut, compute_uv=False)
+        if singular_values[1] > tol * singular_values[0]:
+            return False
+
+    return True
+
+
+class StructureCanonicalizer:
+    def __init__(self, num_qubits: int, mq_dict: Dict[int, np.ndarray], target: np.ndarray,
+                 non_fixed_params: np.ndarray = None, fixed_params_vals: np.ndarray = None, tol: float = 1e-9):
+        """
+        Constructor for StructureCanonicalizer class. Finds every symmetry of the target and gate set
+        that is compatible with the fixed parameters.
+
+        :param num_qubits: number of qubits used by target operation
+        :param mq_dict: dictionary mapping integers [0, n) to 2^num_qubits x 2^num_qubits complex unitaries
+        :param target: 2^num_qubits x 2^num_qubits target complex unitary matrix
+        :param non_fixed_params: optional 0/1 Numpy array marking the parameters the optimizer may change
+        (fixes the circuit depth; default: all parameters free)
+        :param fixed_params_vals: Numpy array of values taken by the fixed parameters
+        :param tol: absolute tolerance used when comparing matrices
+        """
+        self.num_qubits = num_qubits
+        self.mq_dict = mq_dict
+        self.target = target
+        self.non_fixed_params = non_fixed_params
+        self.fixed_params_vals = fixed_params_vals
+        self.tol = tol
+        self._matrices = {key: instruction_matrix(instruction, num_qubits) for key, instruction in mq_dict.items()}
+
+        qubit_maps = {}
+        for perm in permutations(range(num_qubits)):
+            label_map = self._label_map(lambda matrix: permute_qubits(matrix, perm))
+            if label_map is not None:
+                qubit_maps[perm] = label_map
+        self._qubit_maps = qubit_maps
+        self._conjugate_map = self._label_map(np.conj)
+        self._reverse_map = self._label_map(lambda matrix: np.conj(matrix).T)
+
+        conjugations = (False, True) if self._conjugate_map is not None else (False,)
+        reversals = (False, True) if self._reverse_map is not None else (False,)
+        self.symmetries = [(perm, conjugate, reverse) for perm in qubit_maps
+                           for conjugate in conjugations for reverse in reversals
+                           if self._preserves_fixed_params((perm, conjugate, reverse))]
+
+    def _label_map(self, operation) -> Dict[int, int]:
+        """
+        Determines how an operation on unitaries acts on the instruction labels.
+
+        :param operation: function mapping a unitary matrix to a unitary matrix
+        :return: dictionary mapping every key of mq_dict to the key of its image, or None if the
+        operation does not fix the target or maps an instruction outside of mq_dict
+        """
+        if not np.allclose(operation(self.target), self.target, atol=self.tol):
+            return None
+
+        label_map = {}
+        for key, matrix in self._matrices.items():
+            image = operation(matrix)
+            matches = [other for other, candidate in self._matrices.items() if np.allclose(image, candidate, atol=self.tol)]
+            if not matches:
+                return None
+            label_map[key] = matches[0]
+
+        return label_map
+
+    def _preserves_fixed_params(self, symmetry: Symmetry) -> bool:
+        """
+        Checks that a symmetry maps fixed parameters to fixed parameters with the same values.
+
+        :param symmetry: (qubit permutation, conjugate, reverse) triple
+        :return: True if the fixed parameters are invariant
+        """
+        if self.non_fixed_params is None:
+            return True
+
+        fixed_params_vals = np.zeros(len(self.non_fixed_params)) if self.fixed_params_vals is None else self.fixed_params_vals
+        mask = np.asarray(self.non_fixed_params, dtype=np.float64)
+
+        return (np.array_equal(self._transform_layout(mask, symmetry, negate=False), mask)
+                and np.allclose(self.transform_params(fixed_params_vals, symmetry), fixed_params_vals))
+
+    def _transform_layout(self, params: np.ndarray, symmetry: Symmetry, negate: bool) -> np.ndarray:
+        """
+        Moves (and optionally negates) parameter values the way a symmetry moves U3 gates.
+
+        :param params: Numpy array of parameters completing quantum circuit specification
+        :param symmetry: (qubit permutation, conjugate, reverse) triple
+        :param negate: whether to apply the sign changes of the angles
+        :return: Numpy array of transformed parameters
+        """
+        perm, conjugate, reverse = symmetry
+        angles = np.reshape(params, (-1, self.num_qubits, 3))
+
+        result = np.empty_like(angles)
+        result[:, list(perm), :] = angles
+        if conjugate and negate:
+            result[..., 1:] = -result[..., 1:]  # u3(theta, phi, lam)* = u3(theta, -phi, -lam)
+        if reverse:
+            result = result[::-1][..., [0, 2, 1]]  # u3(theta, phi, lam)^dagger = u3(-theta, -lam, -phi)
+            if negate:
+                result = -result
+
+        return result.reshape(-1)
+
+    def transform_params(self, params: np.ndarray, symmetry: Symmetry) -> np.ndarray:
+        """
+        Maps parameters of a structure to parameters of its image under a symmetry that implement the
+        image of the original unitary.
+
+        :param params: Numpy array of parameters completing quantum circuit specification
+        :param symmetry: (qubit permutation, conjugate, reverse) triple
+        :return: Numpy array of transformed parameters
+        """
+        return self._transform_layout(params, symmetry, negate=True)
+
+    def transform_structure(self, structure: Sequence[int], symmetry: Symmetry) -> List[int]:
+        """
+        Maps a circuit structure to its image under a symmetry.
+
+        :param structure: a sequence of instruction indices
+        :param symmetry: (qubit permutation, conjugate, reverse) triple
+        :return: a list of instruction indices
+        """
+        perm, conjugate, reverse = symmetry
+        image = [self._qubit_maps[perm][ins] for ins in structure]
+        if conjugate:
+            image = [self._conjugate_map[ins] for ins in image]
+        if reverse:
+            image = [self._reverse_map[ins] for ins in reversed(image)]
+
+        return image
+
+    @staticmethod
+    def inverse(symmetry: Symmetry) -> Symmetry:
+        """
+        Inverts a symmetry.
+
+        :param symmetry: (qubit permutation, conjugate, reverse) triple
+        :return: the inverse (qubit permutation, conjugate, reverse) triple
+        """
+        perm, conjugate, reverse = symmetry
+
+        return tuple(int(qubit) for qubit in np.argsort(perm)), conjugate, reverse
+
+    def orbit(self, structure: Sequence[int]) -> List[Tuple[List[int], Symmetry]]:
+        """
+        Lists the distinct images of a structure under all symmetries.
+
+        :param structure: a sequence of instruction indices
+        :return: list of (image structure, symmetry mapping structure to the image) pairs
+        """
+        images = {}
+        for symmetry in self.symmetries:
+            image = self.transform_structure(structure, symmetry)
+            images.setdefault(tuple(image), (image, symmetry))
+
+        return list(images.values())
+
+    def canonical(self, structure: Sequence[int]) -> Tuple[List[int], Symmetry]:
+        """
+        Picks the representative of the equivalence class of a structure: the image with the smallest
+        index (see pyquopt.structures.rank_structure).
+
+        :param structure: a sequence of instruction indices
+        :return: tuple of the representative and the symmetry mapping structure to it
+        """
+        num_mq_ins = max(self.mq_dict) + 1
+
+        return min(self.orbit(structure), key=lambda pair: rank_structure(pair[0], num_mq_ins))
+
+    def is_canonical(self, structure: Sequence[int]) -> bool:
+        """
+        Checks whether a structure is the representative of its equivalence class.
+
+        :param structure: a sequence of instruction indices
+        :return: True if structure is its own representative
+        """
+        return list(self.canonical(structure)[0]) == list(structure)
+
+    def is_reducible(self, structure: Sequence[int]) -> bool:
+        """
+        Checks whether consecutive multi-qubit instructions separated only by fully fixed U3 layers
+        multiply to a tensor product of single-qubit gates (e.g. two identical CX gates around an
+        identity layer). The neighbouring free U3 layers then absorb the product, so the structure
+        implements exactly what a structure two or more instructions shallower implements. With free
+        U3 layers between all instructions nothing cancels and no structure is reducible.
+
+        :param structure: a sequence of instruction indices
+        :return: True if the structure is reducible
+        """
+        if self.non_fixed_params is None:
+            return False
+
+        free_layers = np.reshape(self.non_fixed_params, (-1, self.num_qubits * 3)).any(axis=1)
+        fixed_params_vals = np.zeros(len(self.non_fixed_params)) if self.fixed_params_vals is None else self.fixed_params_vals
+        builder = UnitaryBuilder(self.num_qubits, list(structure), self.mq_dict)
+        layers = builder.u3_layers(fixed_params_vals)
+
+        for first in range(1, len(structure)):
+            product = self._matrices[structure[first - 1]]
+            for layer in range(first, len(structure)):
+                if free_layers[layer]:
+                    break
+                product = product @ builder.kron_u3_layer(layers[layer]) @ self._matrices[structure[layer]]
+                if is_local(product, self.num_qubits, self.tol):
+                    return True
+
+        return False
+
+    def partition(self, structures: Sequence[Sequence[int]],
+                  prune_reducible: bool = True) -> Tuple[Dict[Tuple[int, ...], List[Tuple[int, ...]]], List[Tuple[int, ...]]]:
+        """
+        Groups structures by equivalence class.
+
+        :param structures: sequence of structures to prune
+        :param prune_reducible: drop reducible structures (see is_reducible) from the classes
+        :return: tuple of a dictionary mapping each representative to the structures that inherit its
+        result (including itself) and the list of reducible structures that were dropped
+        """
+        classes = {}
+        reducible = []
+        for structure in structures:
+            if prune_reducible and self.is_reducible(structure):
+                reducible.append(tuple(structure))
+                continue
+            representative, _ = self.canonical(structure)
+            classes.setdefault(tuple(representative), []).append(tuple(structure))
+
+        return classes, reducible
@@ -3,22 +3,348 @@
 """
 This module contains tools for building unitary matrices from parameterized quantum circuits.
 """
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import numpy as np
 
 
+class DenseFactor:
+    def __init__(self, matrix: np.ndarray):
+        """
+        Constructor for DenseFactor class, a constant factor of a circuit multiplied as a dense matrix.
+
+        :param matrix: 2^n x 2^n complex matrix
+        """
+        self.matrix = matrix
+
+    def astype(self, dtype: type) -> 'DenseFactor':
+        return DenseFactor(self.matrix.astype(dtype))
+
+    def apply_right(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: complex array of shape (..., 2^n, 2^n)
+        :return: matrix @ self.matrix
+        """
+        return matrix @ self.matrix
+
+    def apply_left(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: complex array of shape (..., 2^n, 2^n)
+        :return: self.matrix @ matrix
+        """
+        return self.matrix @ matrix
+
+
+class MonomialFactor:
+    def __init__(self, matrix: np.ndarray):
+        """
+        Constructor for MonomialFactor class, a constant factor with exactly one nonzero entry per row
+        and column (a permutation times a diagonal phase, e.g. CX, Toffoli or a controlled rotation by a
+        multiple of pi/2). Products with it are a gather of rows or columns plus a phase multiply, which
+        costs O(4^n) instead of the O(8^n) of a dense product.
+
+        :param matrix: 2^n x 2^n complex monomial matrix (see is_monomial)
+        """
+        self.matrix = matrix
+        dim = matrix.shape[0]
+        self.rows = np.argmax(matrix != 0, axis=0)  # row of the nonzero entry of every column
+        self.column_phases = matrix[self.rows, np.arange(dim)]
+        self.columns = np.argmax(matrix != 0, axis=1)  # column of the nonzero entry of every row
+        self.row_phases = matrix[np.arange(dim), self.columns][:, None]
+        self.is_permutation = bool(np.all(self.column_phases == 1))
+
+    @staticmethod
+    def is_monomial(matrix: np.ndarray) -> bool:
+        """
+        Checks whether a square matrix has exactly one nonzero entry in every row and every column.
+
+        :param matrix: square complex matrix
+        :return: True if the matrix is monomial
+        """
+        nonzero = matrix != 0
+
+        return bool(np.all(np.count_nonzero(nonzero, axis=0) == 1) and np.all(np.count_nonzero(nonzero, axis=1) == 1))
+
+    def astype(self, dtype: type) -> 'MonomialFactor':
+        return MonomialFactor(self.matrix.astype(dtype))
+
+    def apply_right(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: complex array of shape (..., 2^n, 2^n)
+        :return: matrix @ self.matrix, whose column j is column rows[j] of matrix times its phase
+        """
+        if self.is_permutation:
+            return matrix[..., self.rows]
+
+        return matrix[..., self.rows] * self.column_phases
+
+    def apply_left(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: complex array of shape (..., 2^n, 2^n)
+        :return: self.matrix @ matrix, whose row i is row columns[i] of matrix times its phase
+        """
+        if self.is_permutation:
+            return matrix[..., self.columns, :]
+
+        return matrix[..., self.columns, :] * self.row_phases
+
+
+class LocalFactor:
+    def __init__(self, gate: np.ndarray, qubits: Tuple[int, ...], num_qubits: int):
+        """
+        Constructor for LocalFactor class, a gate acting on a few of the qubits of a circuit. Products
+        with it contract the gate against the matching tensor indices, which costs O(2^k 4^n) for a
+        k-qubit gate instead of the O(8^n) of a dense product, and the full matrix is never stored
+        unless asked for.
+
+        :param gate: 2^k x 2^k complex unitary, with qubits[0] as its most significant qubit
+        :param qubits: the k distinct qubits the gate acts on
+        :param num_qubits: number of qubits of the circuit
+        """
+        if gate.shape != (2 ** len(qubits), 2 ** len(qubits)):
+            raise Exception("Error: gate size does not match its number of qubits")
+        if len(set(qubits)) != len(qubits) or not all(0 <= qubit < num_qubits for qubit in qubits):
+            raise Exception("Error: invalid qubits for local gate")
+
+        self.gate = gate
+        self.qubits = tuple(int(qubit) for qubit in qubits)
+        self.num_qubits = num_qubits
+
+        # Reorder the gate's qubits to ascending order, so the register splits into
+        # (rest, qubit, rest, qubit, ..., rest) blocks that can be contracted without transposes
+        num_local = len(qubits)
+        order = list(np.argsort(self.qubits))
+        self._tensor = gate.reshape((2, ) * 2 * num_local).transpose(order + [num_local + axis for axis in order])
+        sorted_qubits = sorted(self.qubits)
+        bounds = [-1] + sorted_qubits + [num_qubits]
+        self._blocks = []
+        for index in range(num_local + 1):
+            self._blocks.append(2 ** (bounds[index + 1] - bounds[index] - 1))
+            if index < num_local:
+                self._blocks.append(2)
+
+        letters = 'abcdefghijklmnopqrstuvw'
+        rest = letters[:num_local + 1]
+        inputs = letters[num_local + 1:2 * num_local + 1]
+        outputs = letters[2 * num_local + 1:3 * num_local + 1]
+
+        def interleave(local):
+            return ''.join(rest[index] + local[index] for index in range(num_local)) + rest[num_local]
+
+        # matrix @ full gate contracts the column qubits, full gate @ matrix the row qubits
+        self._right = f'...z{interleave(inputs)},{inputs}{outputs}->...z{interleave(outputs)}'
+        self._left = f'{outputs}{inputs},...{interleave(inputs)}z->...{interleave(outputs)}z'
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        The 2^n x 2^n matrix of the gate on the full register.
+        """
+        return self.apply_left(np.eye(2 ** self.num_qubits, dtype=self.gate.dtype))
+
+    def astype(self, dtype: type) -> 'LocalFactor':
+        return LocalFactor(self.gate.astype(dtype), self.qubits, self.num_qubits)
+
+    def apply_right(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: complex array of shape (..., 2^n, 2^n)
+        :return: matrix @ self.matrix, contracting the gate against the column qubits
+        """
+        tensor = matrix.reshape(matrix.shape[:-1] + tuple(self._blocks))
+
+        return np.einsum(self._right, tensor, self._tensor).reshape(matrix.shape)
+
+    def apply_left(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        :param matrix: complex array of shape (..., 2^n, 2^n)
+        :return: self.matrix @ matrix, contracting the gate against the row qubits
+        """
+        tensor = matrix.reshape(matrix.shape[:-2] + tuple(self._blocks) + matrix.shape[-1:])
+
+        return np.einsum(self._left, self._tensor, tensor).reshape(matrix.shape)
+
+
+def instruction_factor(instruction, num_qubits: int):
+    """
+    Wraps an entry of mq_dict: either a full 2^num_qubits x 2^num_qubits matrix, or a pair of a
+    2^k x 2^k gate and the tuple of the k qubits it acts on.
+
+    :param instruction: matrix or (gate, qubits) pair
+    :param num_qubits: number of qubits of the circuit
+    :return: the matrix itself, or a LocalFactor
+    """
+    if isinstance(instruction, tuple):
+        gate, qubits = instruction
+        return LocalFactor(np.asarray(gate, dtype=np.complex128), qubits, num_qubits)
+
+    return instruction
+
+
+def instruction_matrix(instruction, num_qubits: int) -> np.ndarray:
+    """
+    Expands an entry of mq_dict (see instruction_factor) to its 2^num_qubits x 2^num_qubits matrix.
+
+    :param instruction: matrix or (gate, qubits) pair
+    :param num_qubits: number of qubits of the circuit
+    :return: complex matrix
+    """
+    factor = instruction_factor(instruction, num_qubits)
+
+    return factor.matrix if isinstance(factor, LocalFactor) else factor
+
+
+def constant_factor(matrix):
+    """
+    Picks the fastest representation of a constant circuit factor.
+
+    :param matrix: 2^n x 2^n complex matrix, or a LocalFactor
+    :return: MonomialFactor if the matrix is monomial, otherwise the LocalFactor or a DenseFactor
+    """
+    if isinstance(matrix, LocalFactor):
+        return MonomialFactor(matrix.matrix) if MonomialFactor.is_monomial(matrix.gate) else matrix
+
+    return MonomialFactor(matrix) if MonomialFactor.is_monomial(matrix) else DenseFactor(matrix)
+
+
 class UnitaryBuilder:
-    def __init__(self, num_qubits: int, mq_instructions: List[int], mq_dict: Dict[int, np.ndarray]):
+    def __init__(self, num_qubits: int, mq_instructions: List[int], mq_dict: Dict[int, np.ndarray],
+                 non_fixed_params: np.ndarray = None, fixed_params_vals: np.ndarray = None,
+                 dtype: type = np.complex128):
         """
         Constructor for UnitaryBuilder object.
 
+        U3 gates whose three parameters are all fixed are multiplied into the neighbouring
+        multi-qubit instructions once, here, and layers without any free gate disappear from
+        the circuit product entirely. Parameter values passed for such gates are ignored.
+        Constant factors with one nonzero entry per row and column (e.g. products of CX gates) are
+        applied as gathers with phases (see MonomialFactor), all others as dense products.
+
         :param num_qubits: number of qubits in quantum circuit from which to build unitary
         :param mq_instructions: number of multi-qubit instructions available in quantum computer ISA
-        :param mq_dict: dictionary mapping integers to multi-qubit instructions specified as unitary matrices
+        :param mq_dict: dictionary mapping integers to multi-qubit instructions specified as unitary matrices,
+        or as (2^k x 2^k unitary, tuple of k qubits) pairs applied by local contraction
+        :param non_fixed_params: optional 0/1 Numpy array marking the parameters that may vary (default: all)
+        :param fixed_params_vals: Numpy array of values taken by the fixed parameters
+        :param dtype: complex dtype of the built matrices (np.complex64 halves memory traffic at single precision)
         """
         self.num_qubits = num_qubits
         self.mq_instructions = mq_instructions
         self.mq_dict = mq_dict
+        self.dim = 2 ** num_qubits
+        self.num_params = 3 * num_qubits * (len(mq_instructions) + 1)
+        self.dtype = np.dtype(dtype)
+        self._program = [(kind, constant_factor(value).astype(self.dtype) if kind == 'matrix' else value)
+                         for kind, value in self._compile(non_fixed_params, fixed_params_vals)]
+
+    def _compile(self, non_fixed_params: np.ndarray, fixed_params_vals: np.ndarray) -> List[Tuple[str, object]]:
+        """
+        Turns the circuit into the sequence of factors multiplied out by build_unitary. Each factor is
+        either ('layer', (layer, qubits)), the U3 gates of a layer acting on the qubits with free
+        parameters, or ('matrix', matrix), a constant product of multi-qubit instructions and fixed U3
+        gates. Fixed gates commute with the free gates of their layer, so they are folded into the
+        following instruction (the preceding one for the last layer). A local instruction stays a
+        LocalFactor unless it has to be multiplied with another constant factor.
+
+        :param non_fixed_params: 0/1 Numpy array marking the parameters that may vary, or None
+        :param fixed_params_vals: Numpy array of values taken by the fixed parameters
+        :return: list of (kind, value) factors
+        """
+        num_layers = len(self.mq_instructions) + 1
+        if non_fixed_params is None:
+            free_gates = np.ones((num_layers, self.num_qubits), dtype=bool)
+        else:
+            free_gates = np.reshape(non_fixed_params, (num_layers, self.num_qubits, 3)).any(axis=2)
+            fixed_layers = self.u3_layers(np.zeros(self.num_params) if fixed_params_vals is None else fixed_params_vals)
+
+        program = []
+
+        def dense(matrix):
+            return matrix.matrix if isinstance(matrix, LocalFactor) else matrix
+
+        def append_matrix(matrix):
+            if isinstance(matrix, LocalFactor):
+                if np.array_equal(matrix.gate, np.eye(len(matrix.gate))):
+                    return
+            elif np.array_equal(matrix, np.eye(self.dim)):
+                return
+            if program and program[-1][0] == 'matrix':
+                program[-1] = ('matrix', dense(program[-1][1]) @ dense(matrix))
+            elif isinstance(matrix, LocalFactor):
+                program.append(('matrix', matrix))
+            else:
+                program.append(('matrix', np.array(matrix, dtype=np.complex128)))
+
+        for layer in range(num_layers):
+            if layer > 0:
+                append_matrix(instruction_factor(self.mq_dict[self.mq_instructions[layer - 1]], self.num_qubits))
+
+            qubits = tuple(int(qubit) for qubit in np.flatnonzero(free_gates[layer]))
+            fixed_part = None
+            if len(qubits) < self.num_qubits:
+                fixed_gates = fixed_layers[layer].copy()
+                fixed_gates[list(qubits)] = np.eye(2)
+                fixed_part = self.kron_u3_layer(fixed_gates)
+
+            if fixed_part is not None and layer == num_layers - 1:
+                append_matrix(fixed_part)
+            if qubits:
+                program.append(('layer', (layer, qubits)))
+            if fixed_part is not None and layer < num_layers - 1:
+                append_matrix(fixed_part)
+
+        return program
+
+    @staticmethod
+    def u3_matrix(theta, phi, lam, dtype: type = np.complex128) -> np.ndarray:
+        """
+        Generates the 2x2 matrix of a U3 gate. Angles may be arrays of equal shape, in which
+        case a stack of matrices with two trailing axes is returned.
+
+        :param theta: theta value of U3 gate (see Qiskit documentation)
+        :param phi: phi value of U3 gate (see Qiskit documentation)
+        :param lam: lambda value of U3 gate (see Qiskit documentation)
+        :param dtype: complex dtype of the result
+        :return: complex array of shape (..., 2, 2)
+        """
+        cos = np.cos(np.asarray(theta) / 2)
+        sin = np.sin(np.asarray(theta) / 2)
+        exp_phi = np.exp(1j * np.asarray(phi))
+        exp_lam = np.exp(1j * np.asarray(lam))
+
+        gate = np.empty(np.shape(cos) + (2, 2), dtype=dtype)
+        gate[..., 0, 0] = cos
+        gate[..., 0, 1] = -exp_lam * sin
+        gate[..., 1, 0] = exp_phi * sin
+        gate[..., 1, 1] = exp_phi * exp_lam * cos
+
+        return gate
+
+    @staticmethod
+    def u3_derivatives(theta, phi, lam, dtype: type = np.complex128) -> np.ndarray:
+        """
+        Generates the partial derivatives of the 2x2 U3 matrix with respect to its angles.
+
+        :param theta: theta value of U3 gate (see Qiskit documentation)
+        :param phi: phi value of U3 gate (see Qiskit documentation)
+        :param lam: lambda value of U3 gate (see Qiskit documentation)
+        :param dtype: complex dtype of the result
+        :return: complex array of shape (..., 3, 2, 2) holding d/dtheta, d/dphi and d/dlambda
+        """
+        cos = np.cos(np.asarray(theta) / 2)
+        sin = np.sin(np.asarray(theta) / 2)
+        exp_phi = np.exp(1j * np.asarray(phi))
+        exp_lam = np.exp(1j * np.asarray(lam))
+
+        grad = np.zeros(np.shape(cos) + (3, 2, 2), dtype=dtype)
+        grad[..., 0, 0, 0] = -sin / 2
+        grad[..., 0, 0, 1] = -exp_lam * cos / 2
+        grad[..., 0, 1, 0] = exp_phi * cos / 2
+        grad[..., 0, 1, 1] = -exp_phi * exp_lam * sin / 2
+        grad[..., 1, 1, 0] = 1j * exp_phi * sin
+        grad[..., 1, 1, 1] = 1j * exp_phi * exp_lam * cos
+        grad[..., 2, 0, 1] = -1j * exp_lam * sin
+        grad[..., 2, 1, 1] = 1j * exp_phi * exp_lam * cos
+
+        return grad
 
     def u3(self, theta: float, phi: float, lam: float, qubit: int) -> np.ndarray:
         """
@@ -33,19 +359,102 @@ class UnitaryBuilder:
         if qubit + 1 > self.num_qubits:
             raise Exception("Error: invalid qubit")
 
-        gate = 1
-        for i in range(qubit):
-            gate = np.kron(gate, np.eye(2))
+        gate = np.kron(np.eye(2 ** qubit), self.u3_matrix(theta, phi, lam))
+        gate = np.kron(gate, np.eye(2 ** (self.num_qubits - qubit - 1)))
+
+        return gate
+
+    def u3_layers(self, params: np.ndarray) -> np.ndarray:
+        """
+        Generates the 2x2 U3 matrices of every layer of the circuit.
 
-        gate = np.kron(gate, np.array([
-            [np.cos(theta / 2), -np.exp(1j * lam) * np.sin(theta / 2)],
-            [np.exp(1j * phi) * np.sin(theta / 2), np.exp(1j * (phi + lam)) * np.cos(theta / 2)]]
-        ))
+        :param params: beta vector specifying U3 values from right to left
+        and top to down in theta, phi, lambda order, or a stack of such vectors
+        with shape (..., num_params)
+        :return: complex array of shape (..., layers, num_qubits, 2, 2)
+        """
+        params = np.asarray(params)
+        angles = params.reshape(params.shape[:-1] + (-1, self.num_qubits, 3))
 
-        for i in range(self.num_qubits - qubit - 1):
-            gate = np.kron(gate, np.eye(2))
+        return self.u3_matrix(angles[..., 0], angles[..., 1], angles[..., 2], self.dtype)
 
-        return gate
+    def apply_u3_layer(self, matrix: np.ndarray, gates: np.ndarray, qubits: Tuple[int, ...] = None) -> np.ndarray:
+        """
+        Right-multiplies a matrix by the tensor product of one U3 gate per qubit. Each 2x2
+        gate is contracted against the matching column index of the matrix viewed as a
+        (2^num_qubits, 2, ..., 2) tensor, so the layer costs O(num_qubits * 4^num_qubits)
+        instead of the O(8^num_qubits) of a dense product. Leading axes of matrix and gates
+        are treated as batch axes.
+
+        :param matrix: complex array of shape (..., 2^num_qubits, 2^num_qubits)
+        :param gates: complex array of shape (..., num_qubits, 2, 2) holding the layer's U3 matrices
+        :param qubits: qubits whose gates are applied (default: all)
+        :return: matrix @ (gates[0] x gates[1] x ... x gates[num_qubits - 1])
+        """
+        batch_shape = matrix.shape[:-2]
+        for qubit in range(self.num_qubits) if qubits is None else qubits:
+            tensor = matrix.reshape(batch_shape + (self.dim * 2 ** qubit, 2, 2 ** (self.num_qubits - qubit - 1)))
+            matrix = np.einsum('...akb,...kc->...acb', tensor, gates[..., qubit, :, :])
+
+        return matrix.reshape(batch_shape + (self.dim, self.dim))
+
+    def kron_u3_layer(self, gates: np.ndarray) -> np.ndarray:
+        """
+        Forms the tensor product of one U3 gate per qubit.
+
+        :param gates: complex array of shape (..., num_qubits, 2, 2) holding the layer's U3 matrices
+        :return: complex array of shape (..., 2^num_qubits, 2^num_qubits)
+        """
+        batch_shape = gates.shape[:-3]
+
+        matrix = gates[..., 0, :, :]
+        for qubit in range(1, self.num_qubits):
+            matrix = np.einsum('...ij,...kl->...ikjl', matrix, gates[..., qubit, :, :])
+            matrix = matrix.reshape(batch_shape + (2 ** (qubit + 1), 2 ** (qubit + 1)))
+
+        return matrix
+
+    def _build(self, layers: np.ndarray) -> np.ndarray:
+        """
+        Multiplies out the circuit given the U3 matrices of every layer.
+
+        :param layers: complex array of shape (..., layers, num_qubits, 2, 2)
+        :return: complex array of shape (..., 2^num_qubits, 2^num_qubits)
+        """
+        batch_shape = layers.shape[:-4]
+
+        matrix = None
+        for kind, value in self._program:
+            if kind == 'matrix':
+                if matrix is None:
+                    matrix = np.array(np.broadcast_to(value.matrix, batch_shape + value.matrix.shape))
+                else:
+                    matrix = value.apply_right(matrix)
+            elif matrix is None:
+                matrix = self.kron_u3_layer(self._layer_gates(layers, *value))
+            else:
+                matrix = self.apply_u3_layer(matrix, layers[..., value[0], :, :, :], value[1])
+
+        if matrix is None:
+            matrix = np.array(np.broadcast_to(np.eye(self.dim, dtype=self.dtype), batch_shape + (self.dim, self.dim)))
+
+        return matrix
+
+    def _layer_gates(self, layers: np.ndarray, layer: int, qubits: Tuple[int, ...]) -> np.ndarray:
+        """
+        Selects the U3 matrices of a layer, replacing the gates on qubits outside qubits by the identity.
+
+        :param layers: complex array of shape (..., layers, num_qubits, 2, 2)
+        :param layer: index of the layer
+        :param qubits: qubits whose gates are kept
+        :return: complex array of shape (..., num_qubits, 2, 2)
+        """
+        gates = layers[..., layer, :, :, :]
+        if len(qubits) < self.num_qubits:
+            gates = gates.copy()
+            gates[..., [qubit for qubit in range(self.num_qubits) if qubit not in qubits], :, :] = np.eye(2)
+
+        return gates
 
     def build_unitary(self, params: np.ndarray) -> np.ndarray:
         """
@@ -55,20 +464,151 @@ class UnitaryBuilder:
         and top to down in theta, phi, lambda order
         :returns: a unitary Numpy matrix
         """
-        matrix = np.eye(2 ** self.num_qubits, dtype=np.complex128)
+        return self._build(self.u3_layers(params))
 
-        for qubit in range(self.num_qubits):
-            matrix = matrix @ self.u3(params[3 * qubit], params[3 * qubit + 1], params[3 * qubit + 2], qubit)
+    def build_unitaries(self, params_batch: np.ndarray) -> np.ndarray:
+        """
+        Build the unitaries of many parameter vectors at once. All vectors are processed
+        together by stacked contractions and matrix products, so the Python-level work is
+        the same as for a single call to build_unitary.
 
-        for layer in range(len(self.mq_instructions)):
-            matrix = matrix @ self.mq_dict[self.mq_instructions[layer]]
-            for qubit in range(self.num_qubits):
-                layer_start = 3 * self.num_qubits * (layer + 1)
-                matrix = matrix @ self.u3(params[layer_start + 3 * qubit],
-                                          params[layer_start + 3 * qubit + 1],
-                                          params[layer_start + 3 * qubit + 2],
-                                          qubit
-                                          )
+        :param params_batch: B x num_params array, one beta vector per row
+        :returns: B x 2^num_qubits x 2^num_qubits array of unitary matrices
+        """
+        params_batch = np.asarray(params_batch)
+        if params_batch.ndim != 2 or params_batch.shape[1] != self.num_params:
+            raise Exception(f"Error: expected parameter batch of shape (B, {self.num_params})")
 
-        return matrix
+        return self._build(self.u3_layers(params_batch))
+
+    def apply_local_left(self, gates: np.ndarray, qubit: int, matrix: np.ndarray) -> np.ndarray:
+        """
+        Left-multiplies a matrix by 2x2 gates acting on a single qubit by contracting each gate
+        against the matching row index of the matrix.
+
+        :param gates: complex array of shape (..., 2, 2)
+        :param qubit: qubit on which the gates act
+        :param matrix: 2^num_qubits x 2^num_qubits complex matrix
+        :return: complex array of shape (..., 2^num_qubits, 2^num_qubits)
+        """
+        tensor = matrix.reshape(2 ** qubit, 2, 2 ** (self.num_qubits - qubit - 1) * self.dim)
+        product = np.einsum('...ij,ajb->...aib', gates, tensor)
+
+        return product.reshape(gates.shape[:-2] + (self.dim, self.dim))
+
+    def unitary_jacobian(self, params: np.ndarray, indices: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Build the unitary of a parameter vector together with its exact derivative with respect
+        to every parameter. Writing the circuit as U = Q_l S_l, where Q_l is the product up to and
+        including U3 layer l and S_l the remaining product, the derivative with respect to an angle
+        of the U3 gate u on qubit q of layer l is Q_l (I x u^dagger du x I) S_l. Derivatives with
+        respect to fixed gates are zero.
+
+        :param params: beta vector specifying U3 values from right to left
+        and top to down in theta, phi, lambda order
+        :param indices: sorted indices of the parameters to differentiate with respect to (default: all)
+        :return: tuple of the unitary and a len(indices) x 2^num_qubits x 2^num_qubits array of derivatives
+        """
+        layers, generators, prefixes = self._differentiate(params)
+
+        wanted = np.zeros(self.num_params, dtype=bool)
+        wanted[np.arange(self.num_params) if indices is None else indices] = True
+        positions = np.cumsum(wanted).reshape(layers.shape[0], self.num_qubits, 3) - 1
+        wanted = wanted.reshape(layers.shape[0], self.num_qubits, 3)
+        needed = [kind == 'layer' and wanted[value[0], list(value[1])].any() for kind, value in self._program]
+
+        jacobian = np.zeros((np.count_nonzero(wanted), self.dim, self.dim), dtype=self.dtype)
+        suffix = np.eye(self.dim, dtype=self.dtype)
+        for index in reversed(range(len(self._program))):
+            kind, value = self._program[index]
+            if needed[index]:
+                layer, qubits = value
+                for qubit in qubits:
+                    angles = wanted[layer, qubit]
+                    if angles.any():
+                        local = self.apply_local_left(generators[layer, qubit, angles], qubit, suffix)
+                        jacobian[positions[layer, qubit, angles]] = prefixes[index] @ local
+            if not any(needed[:index]):
+                break
+            suffix = self._prepend_factor(layers, self._program[index], suffix)
+
+        return prefixes[-1], jacobian
+
+    def unitary_gradient(self, params: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Calculates Re tr(weights^dagger dU/dp) for every parameter p without forming the individual
+        derivatives dU/dp. With U = Q_l S_l as in unitary_jacobian, the trace equals
+        Re tr(X_l (I x u^dagger du x I)) for X_l = S_l weights^dagger Q_l, which only needs the
+        2x2 partial trace of X_l onto each qubit. The gradient of ||U - T||^2 is
+        unitary_gradient(params, 2 * (U - T)).
+
+        :param params: beta vector specifying U3 values from right to left
+        and top to down in theta, phi, lambda order
+        :param weights: 2^num_qubits x 2^num_qubits complex matrix
+        :return: real array with one entry per parameter
+        """
+        layers, generators, prefixes = self._differentiate(params)
+        weights_adjoint = np.conj(weights).T
+
+        gradient = np.zeros((layers.shape[0], self.num_qubits, 3))
+        suffix = np.eye(self.dim, dtype=self.dtype)
+        for index in reversed(range(len(self._program))):
+            kind, value = self._program[index]
+            if kind == 'layer':
+                layer, qubits = value
+                product = suffix @ weights_adjoint @ prefixes[index]
+                for qubit in qubits:
+                    tensor = product.reshape(2 ** qubit, 2, 2 ** (self.num_qubits - qubit - 1),
+                                             2 ** qubit, 2, 2 ** (self.num_qubits - qubit - 1))
+                    reduced = np.einsum('iajibj->ab', tensor)
+                    gradient[layer, qubit] = np.einsum('ab,kba->k', reduced, generators[layer, qubit]).real
+            if index > 0:
+                suffix = self._prepend_factor(layers, self._program[index], suffix)
+
+        return gradient.reshape(-1)
+
+    def _differentiate(self, params: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[np.ndarray]]:
+        """
+        Computes the quantities shared by unitary_jacobian and unitary_gradient.
+
+        :param params: beta vector specifying U3 values from right to left
+        and top to down in theta, phi, lambda order
+        :return: tuple of the U3 matrices of every layer, the matrices u^dagger du for every U3 angle,
+        and the prefix products of the circuit up to and including every factor of the compiled circuit
+        """
+        angles = np.reshape(params, (-1, self.num_qubits, 3))
+        layers = self.u3_matrix(angles[..., 0], angles[..., 1], angles[..., 2], self.dtype)
+        derivatives = self.u3_derivatives(angles[..., 0], angles[..., 1], angles[..., 2], self.dtype)
+        generators = np.conj(np.swapaxes(layers, -1, -2))[..., None, :, :] @ derivatives
+
+        prefixes = []
+        for kind, value in self._program:
+            if kind == 'matrix':
+                prefixes.append(value.matrix if not prefixes else value.apply_right(prefixes[-1]))
+            elif not prefixes:
+                prefixes.append(self.kron_u3_layer(self._layer_gates(layers, *value)))
+            else:
+                prefixes.append(self.apply_u3_layer(prefixes[-1], layers[value[0]], value[1]))
+        if not prefixes:
+            prefixes.append(np.eye(self.dim, dtype=self.dtype))
+
+        return layers, generators, prefixes
+
+    def _prepend_factor(self, layers: np.ndarray, factor: Tuple[str, object], suffix: np.ndarray) -> np.ndarray:
+        """
+        Extends a suffix product to the left by one factor of the compiled circuit.
+
+        :param layers: complex array of shape (layers, num_qubits, 2, 2) holding the U3 matrices
+        :param factor: ('layer', (layer, qubits)) or ('matrix', DenseFactor or MonomialFactor) factor
+        :param suffix: 2^num_qubits x 2^num_qubits complex matrix
+        :return: factor @ suffix
+        """
+        kind, value = factor
+        if kind == 'matrix':
+            return value.apply_left(suffix)
+
+        layer, qubits = value
+        for qubit in qubits:
+            suffix = self.apply_local_left(layers[layer, qubit], qubit, suffix)
 
+        return suffix
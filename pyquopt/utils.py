@@ -34,3 +34,17 @@ def round_params(params: np.ndarray) -> np.ndarray:
     mod_int_deg_params = np.mod(int_deg_params, 360)  # clip to [0, 360) domain
 
     return mod_int_deg_params
+
+
+def get_unitary_infidelities(target: np.ndarray, matrices: np.ndarray, dim: int) -> np.ndarray:
+    """
+    Calculates the infidelity of get_unitary_infidelity between a target unitary matrix and a batch of
+    unitary matrices at once.
+
+    :param target: target matrix
+    :param matrices: array of shape (..., dim, dim) of matrices to compare with target
+    :param dim: dimension of Hilbert space on which the matrices operate
+    :return: array of shape (...) of floats between 0 and 1 (inclusive)
+    """
+
+    return 1 - np.abs(np.einsum('ij,...ij->...', np.conj(target), matrices) / dim) ** 2
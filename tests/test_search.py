@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of DepthIterativeSearch with the structures of a depth spread over several processes.
+"""
+import pyquopt.search
+from pyquopt import DepthIterativeSearch, ResultsStore, TwoGates
+
+
+def test_search_with_processes(tmp_path):
+    store = ResultsStore(str(tmp_path / 'search.sqlite'))
+    search = DepthIterativeSearch(2, {0: TwoGates.CX01}, TwoGates.CX10, store=store)
+    depth, solutions = search.search(3, num_guesses=5, seed=1, procs=2)
+
+    assert depth == 1
+    assert list(solutions) == [(0, )]
+    results = store.load()
+    assert list(results['structure']) == [(0, )]
+    assert results['num_starts'][0] == 1  # the first start meets the threshold
+    store.close()
+
+
+def test_search_stops_worker_ranks_with_coordinator(monkeypatch):
+    # An MPI rank other than the coordinator: it gets no candidates and learns the outcome from rank 0
+    calls = []
+    monkeypatch.setattr(pyquopt.search, 'is_coordinator', lambda: False)
+    monkeypatch.setattr(pyquopt.search, 'distribute_tasks', lambda *args, **kwargs: calls.append(args[1]))
+    monkeypatch.setattr(pyquopt.search, 'broadcast', lambda value: True)
+
+    search = DepthIterativeSearch(2, {0: TwoGates.CX01}, TwoGates.CX10)
+    depth, solutions = search.search(3, num_guesses=5, seed=1, procs=2)
+
+    assert (depth, solutions) == (1, {})
+    assert calls == [[]]